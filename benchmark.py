@@ -0,0 +1,287 @@
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import resource
+import subprocess
+import contextlib
+import multiprocessing
+import helpers
+import tracing
+
+STARTUP_COMMANDS = {"help":["--help"],"branch":["branch"],"status":["status"],"log":["log","--oneline"]}
+HEAVY_MODULES = ("chardet","shelve","configparser","concurrent.futures","multiprocessing")
+GIT_TRACE_FILE = ".microgit/benchmark-trace.json"
+MICROGIT = os.path.join(os.path.dirname(os.path.abspath(__file__)),"microgit.py")
+WORDS = ["alpha","bravo","charlie","delta","echo","foxtrot","golf","hotel","india","juliet","kilo","lima",
+         "mike","november","oscar","papa","quebec","romeo","sierra","tango","uniform","victor","whiskey"]
+
+def file_size(rng,config):
+    if config.size_dist == "fixed":
+        return config.mean_size
+    if config.size_dist == "uniform":
+        return rng.randint(1,config.mean_size*2)
+    return max(1,int(rng.lognormvariate(0,1)*config.mean_size/1.65))
+
+def file_content(rng,size):
+    lines = []
+    length = 0
+    while length < size:
+        line = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3,12))) + "\n"
+        lines.append(line)
+        length += len(line)
+    return "".join(lines)[:size]
+
+def file_name(number):
+    return os.path.join(f"dir{number % 16:02d}",f"sub{number % 5}",f"file{number:06d}.txt")
+
+def write_file(rng,config,number):
+    path = file_name(number)
+    os.makedirs(os.path.dirname(path),exist_ok=True)
+    with open(path,"w") as file:
+        file.write(file_content(rng,file_size(rng,config)))
+    return path
+
+def touch_files(rng,config,partition,partitions,count):
+    candidates = [number for number in range(config.files) if number % partitions == partition]
+    return [write_file(rng,config,number) for number in rng.sample(candidates,min(count,len(candidates)))]
+
+def generate_repository(path,config):
+    rng = random.Random(config.seed)
+    partitions = config.branches+1
+    cwd = os.getcwd()
+    os.makedirs(path,exist_ok=True)
+    os.chdir(path)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            helpers.init()
+            for number in range(config.files):
+                write_file(rng,config,number)
+            helpers.add(["."])
+            helpers.commit("Initial commit")
+            branches = [f"bench-{number}" for number in range(config.branches)]
+            for branch_name in branches:
+                helpers.branch(branch_name)
+            for number in range(1,config.commits):
+                target = number % partitions
+                if target:
+                    helpers.checkout(branches[target-1])
+                paths = touch_files(rng,config,target,partitions,config.changes_per_commit)
+                helpers.add(paths)
+                helpers.commit(f"Commit {number}")
+                if target:
+                    helpers.checkout("master")
+                if branches and config.merge_every and number % config.merge_every == 0:
+                    helpers.merge(branches[(number//config.merge_every) % len(branches)])
+            if branches:
+                helpers.checkout(branches[-1])
+                helpers.add(touch_files(rng,config,partitions-1,partitions,config.changes_per_commit))
+                helpers.commit("Pending branch work")
+                helpers.checkout("master")
+    finally:
+        helpers.clear_caches()
+        os.chdir(cwd)
+
+def scenario(config):
+    branch_name = f"bench-{config.branches-1}" if config.branches else None
+    steps = [
+        ("status",None,["status"],lambda:helpers.status()),
+        ("add","modify",["add","."],lambda:helpers.add(["."])),
+        ("commit",None,["commit","-m","benchmark"],lambda:helpers.commit("benchmark")),
+        ("log",None,["log"],lambda:helpers.log()),
+    ]
+    if branch_name:
+        steps += [
+            ("checkout",None,["checkout",branch_name],lambda:helpers.checkout(branch_name)),
+            ("checkout-back",None,["checkout","master"],lambda:helpers.checkout("master")),
+            ("merge",None,["merge",branch_name],lambda:helpers.merge(branch_name)),
+        ]
+    return steps
+
+def prepare(step_setup,config,rng):
+    if step_setup == "modify":
+        with contextlib.redirect_stdout(io.StringIO()):
+            touch_files(rng,config,0,config.branches+1,config.changes_per_commit)
+
+def run_in_child(path,function,queue):
+    os.chdir(path)
+    helpers.clear_caches()
+    tracing.enable()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    error = None
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            function()
+    except Exception as ex:
+        error = str(ex)
+    elapsed = time.perf_counter()-start
+    queue.put({"wall_s":elapsed,"peak_rss_kb":resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               "rss_growth_kb":resource.getrusage(resource.RUSAGE_SELF).ru_maxrss-before,
+               "object_reads":tracing.counters.get("objects_read",0),"counters":dict(tracing.counters),"error":error})
+
+def measure_inprocess(path,function):
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    process = context.Process(target=run_in_child,args=(path,function,queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+def measure_cli(path,arguments,traced=True):
+    trace_file = os.path.join(path,GIT_TRACE_FILE)
+    command = [sys.executable,MICROGIT] + (["--trace",trace_file] if traced else []) + arguments
+    start = time.perf_counter()
+    process = subprocess.Popen(command,cwd=path,stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+    output = process.stdout.read()
+    _,status,usage = os.wait4(process.pid,0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter()-start
+    counters = {}
+    if traced and os.path.exists(trace_file):
+        with open(trace_file,"r") as file:
+            counters = json.load(file)["otherData"]["counters"]
+        os.remove(trace_file)
+    return {"wall_s":elapsed,"peak_rss_kb":usage.ru_maxrss,"object_reads":counters.get("objects_read",0),"counters":counters,
+            "error":None if process.returncode == 0 else output.decode(errors="replace")[-500:]}
+
+def parse_importtime(stderr):
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = [field.strip() for field in line[len("import time:"):].split("|")]
+        if not fields[0].isdigit():
+            continue
+        modules[fields[2].strip()] = (int(fields[0]),int(fields[1]))
+    return modules
+
+def measure_startup(path,arguments,repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable,"-X","importtime",MICROGIT]+arguments,cwd=path,capture_output=True,text=True)
+        elapsed = time.perf_counter()-start
+        modules = parse_importtime(process.stderr)
+        runs.append({"wall_s":elapsed,"import_s":sum(own for own,_ in modules.values())/1e6,
+                     "heavy_modules":sorted(name for name in modules if name.split(".")[0] in HEAVY_MODULES or name in HEAVY_MODULES),
+                     "modules":len(modules),"error":None if process.returncode == 0 else process.stderr[-500:]})
+    runs.sort(key=lambda run:run["wall_s"])
+    return dict(runs[len(runs)//2],wall_s_min=runs[0]["wall_s"],runs=len(runs),peak_rss_kb=None,object_reads=None)
+
+def run_startup(template,config):
+    path = tempfile.mkdtemp(prefix="microgit-bench-startup-")
+    try:
+        shutil.rmtree(path)
+        shutil.copytree(template,path,symlinks=True)
+        return {name:measure_startup(path,arguments,max(config.repeat,5)) for name,arguments in STARTUP_COMMANDS.items()}
+    finally:
+        shutil.rmtree(path,ignore_errors=True)
+
+def run_scenario(template,mode,config,repeat):
+    results = {}
+    for iteration in range(repeat):
+        path = tempfile.mkdtemp(prefix=f"microgit-bench-{mode}-")
+        try:
+            shutil.rmtree(path)
+            shutil.copytree(template,path,symlinks=True)
+            rng = random.Random(config.seed+1000+iteration)
+            cwd = os.getcwd()
+            for name,setup,arguments,function in scenario(config):
+                os.chdir(path)
+                try:
+                    prepare(setup,config,rng)
+                finally:
+                    os.chdir(cwd)
+                if mode == "inprocess":
+                    result = measure_inprocess(path,function)
+                else:
+                    result = measure_cli(path,arguments)
+                results.setdefault(name,[]).append(result)
+        finally:
+            shutil.rmtree(path,ignore_errors=True)
+    summary = {}
+    for name,runs in results.items():
+        runs.sort(key=lambda run:run["wall_s"])
+        median = runs[len(runs)//2]
+        summary[name] = dict(median,wall_s_min=runs[0]["wall_s"],runs=len(runs))
+    return summary
+
+def compare(results,baseline,tolerance):
+    regressions = []
+    for mode,operations in results["results"].items():
+        for name,result in operations.items():
+            previous = baseline.get("results",{}).get(mode,{}).get(name)
+            if not previous:
+                continue
+            ratio = result["wall_s"]/max(previous["wall_s"],1e-9)
+            marker = ""
+            if ratio > 1+tolerance:
+                regressions.append(f"{mode}/{name}")
+                marker = "  REGRESSION"
+            print(f"{mode:>9} {name:<14} {previous['wall_s']*1000:10.1f}ms -> {result['wall_s']*1000:10.1f}ms ({ratio:5.2f}x){marker}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark microgit against a synthetic repository")
+    parser.add_argument("--files",type=int,default=500,help="Number of files in the repository")
+    parser.add_argument("--mean-size",type=int,default=4096,help="Mean file size in bytes")
+    parser.add_argument("--size-dist",choices=["fixed","uniform","lognormal"],default="lognormal",help="File size distribution")
+    parser.add_argument("--commits",type=int,default=20,help="Number of commits to generate")
+    parser.add_argument("--changes-per-commit",type=int,default=10,help="Files modified per generated commit")
+    parser.add_argument("--branches",type=int,default=2,help="Number of branches")
+    parser.add_argument("--merge-every",type=int,default=5,help="Merge a branch into master every N commits (0 disables)")
+    parser.add_argument("--seed",type=int,default=1,help="Random seed for the generator")
+    parser.add_argument("--mode",choices=["inprocess","cli","both"],default="both",help="Drive helpers directly, through the CLI, or both")
+    parser.add_argument("--startup",help="Also measure CLI startup with -X importtime",action="store_true")
+    parser.add_argument("--repeat",type=int,default=3,help="Repetitions per operation (the median is reported)")
+    parser.add_argument("--output","-o",help="Write JSON results to this file")
+    parser.add_argument("--baseline",help="Compare wall times against a previous JSON result")
+    parser.add_argument("--tolerance",type=float,default=0.25,help="Allowed slowdown ratio before flagging a regression")
+    config = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="microgit-bench-")
+    try:
+        template = os.path.join(work_dir,"template")
+        start = time.perf_counter()
+        generate_repository(template,config)
+        generation_time = time.perf_counter()-start
+        modes = ["inprocess","cli"] if config.mode == "both" else [config.mode]
+        results = {"config":{key:value for key,value in vars(config).items() if key not in ("output","baseline")},
+                   "environment":{"python":platform.python_version(),"platform":platform.platform()},
+                   "generation_s":generation_time,"results":{}}
+        for mode in modes:
+            results["results"][mode] = run_scenario(template,mode,config,config.repeat)
+        if config.startup:
+            results["results"]["startup"] = run_startup(template,config)
+        for mode,operations in results["results"].items():
+            for name,result in operations.items():
+                if mode == "startup":
+                    details = f"imports {result['import_s']*1000:7.1f}ms  heavy {','.join(result['heavy_modules']) or '-'}"
+                else:
+                    details = f"rss {result['peak_rss_kb']:>8}KB  reads {result['object_reads']}"
+                print(f"{mode:>9} {name:<14} {result['wall_s']*1000:10.1f}ms  {details}"
+                      + (f"  ERROR {result['error']}" if result["error"] else ""))
+        if config.output:
+            with open(config.output,"w") as file:
+                json.dump(results,file,indent=4)
+        if config.baseline:
+            with open(config.baseline,"r") as file:
+                baseline = json.load(file)
+            regressions = compare(results,baseline,config.tolerance)
+            if regressions:
+                print(f"Regressions detected: {', '.join(regressions)}")
+                return 1
+        return 0
+    finally:
+        shutil.rmtree(work_dir,ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
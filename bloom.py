@@ -0,0 +1,114 @@
+import os
+import mmap
+import struct
+import hashlib
+
+BLOOM_SIGNATURE = b"MCBF"
+BLOOM_VERSION = 2
+FILTER_BYTES = 256
+HASH_COUNT = 7
+BITS_PER_KEY = 10
+# About 10 bits per key keeps false positives near 1% with 7 hashes. Commits touching more paths get no filter
+# and are always checked against their trees.
+MAX_CHANGED_PATHS = FILTER_BYTES*8//BITS_PER_KEY
+HEADER = struct.Struct(">4sIII")
+RECORD = struct.Struct(f">20sB{FILTER_BYTES}s")
+FILTER_PRESENT = 1
+FILTER_TOO_LARGE = 2
+
+def path_keys(path):
+    """The path and each of its leading directories, so a directory matches every change below it."""
+    parts = path.split("/")
+    return ["/".join(parts[:depth]) for depth in range(1,len(parts)+1)]
+
+def bit_positions(key):
+    first,second = struct.unpack(">II",hashlib.blake2b(key.encode("utf-8"),digest_size=8).digest())
+    return [(first+i*second) % (FILTER_BYTES*8) for i in range(HASH_COUNT)]
+
+def build_filter(paths):
+    keys = set()
+    for path in paths:
+        keys.update(path_keys(path))
+    if len(keys) > MAX_CHANGED_PATHS:
+        return FILTER_TOO_LARGE,bytes(FILTER_BYTES)
+    bits = bytearray(FILTER_BYTES)
+    for key in keys:
+        for position in bit_positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+    return FILTER_PRESENT,bytes(bits)
+
+class ChangedPathFilters:
+    """Per-commit Bloom filters of the paths changed against the first parent, one fixed-width record per commit-graph position."""
+    def __init__(self,path):
+        self.path = path
+        self.map = b""
+        self.count = 0
+        self.appended = []
+        self.load()
+
+    def load(self):
+        self.map = b""
+        self.count = 0
+        self.appended = []
+        if os.path.exists(self.path) and os.path.getsize(self.path) > HEADER.size:
+            with open(self.path,"rb") as file:
+                self.map = mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ)
+            # The filters are derived data: a file written with other parameters is simply rebuilt.
+            if HEADER.unpack_from(self.map,0) == (BLOOM_SIGNATURE,BLOOM_VERSION,FILTER_BYTES,HASH_COUNT):
+                self.count = (len(self.map)-HEADER.size)//RECORD.size
+
+    def __len__(self):
+        return self.count + len(self.appended)
+
+    def record(self,position):
+        if position < self.count:
+            return RECORD.unpack_from(self.map,HEADER.size+position*RECORD.size)
+        return self.appended[position-self.count]
+
+    def maybe_changed(self,position,path):
+        """False only when the commit at position certainly did not change path."""
+        if position >= len(self):
+            return True
+        _,flags,bits = self.record(position)
+        if flags != FILTER_PRESENT:
+            return True
+        return all(bits[bit >> 3] & (1 << (bit & 7)) for bit in bit_positions(path))
+
+    def append(self,records):
+        if not records:
+            return
+        new_file = self.count == 0 and not self.appended
+        with open(self.path,"ab") as file:
+            if new_file:
+                file.truncate(0)
+                file.write(HEADER.pack(BLOOM_SIGNATURE,BLOOM_VERSION,FILTER_BYTES,HASH_COUNT))
+            elif (file.tell()-HEADER.size) % RECORD.size:
+                file.truncate(file.tell()-(file.tell()-HEADER.size) % RECORD.size)
+            file.write(b"".join(RECORD.pack(*record) for record in records))
+        self.appended.extend(records)
+
+    def add(self,sha1,paths):
+        self.append([(bytes.fromhex(sha1),*build_filter(paths))])
+
+    def truncate(self,length):
+        if isinstance(self.map,mmap.mmap):
+            self.map.close()
+        with open(self.path,"r+b") as file:
+            file.truncate(HEADER.size+length*RECORD.size if length else 0)
+        self.load()
+
+    def ensure(self,graph,changed_paths):
+        """Line the filters up with graph, rebuilding from the first position whose commit differs and filling in new commits."""
+        if len(self) > len(graph):
+            self.truncate(len(graph))
+        valid = len(self)
+        if valid and self.record(valid-1)[0] != graph.record(valid-1)[0]:
+            valid = 0
+            while self.record(valid)[0] == graph.record(valid)[0]:
+                valid += 1
+            self.truncate(valid)
+        records = []
+        for position in range(len(self),len(graph)):
+            sha1 = graph.sha1(position)
+            records.append((bytes.fromhex(sha1),*build_filter(changed_paths(sha1))))
+        self.append(records)
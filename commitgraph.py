@@ -0,0 +1,238 @@
+import os
+import mmap
+import heapq
+import struct
+
+GRAPH_SIGNATURE = b"MCGR"
+GRAPH_VERSION = 1
+HEADER = struct.Struct(">4sI")
+RECORD = struct.Struct(">20sIIIq")
+NO_PARENT = 0xffffffff
+LOOKUP_SIGNATURE = b"MCGL"
+LOOKUP_VERSION = 1
+LOOKUP_HEADER = struct.Struct(">4sII20s")
+FANOUT = struct.Struct(">256I")
+LOOKUP_ENTRY = struct.Struct(">20sI")
+# Commits appended after the sorted table was written are kept in a small dict until there are this many.
+MAX_UNSORTED = 256
+
+class CommitLookup:
+    """Sorted commit id -> graph position table, binary-searched through an mmap like a pack .idx."""
+    def __init__(self,path):
+        self.path = path
+        self.map = b""
+        self.count = 0
+        self.last = None
+        if os.path.exists(path) and os.path.getsize(path) >= LOOKUP_HEADER.size+FANOUT.size:
+            with open(path,"rb") as file:
+                self.map = mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ)
+            signature,version,count,last = LOOKUP_HEADER.unpack_from(self.map,0)
+            if signature == LOOKUP_SIGNATURE and version == LOOKUP_VERSION \
+                    and len(self.map) == LOOKUP_HEADER.size+FANOUT.size+count*LOOKUP_ENTRY.size:
+                self.count = count
+                self.last = last
+
+    def fanout(self,byte):
+        if byte < 0:
+            return 0
+        return struct.unpack_from(">I",self.map,LOOKUP_HEADER.size+byte*4)[0]
+
+    def find(self,key):
+        if not self.count:
+            return None
+        low,high = self.fanout(key[0]-1),self.fanout(key[0])
+        while low < high:
+            middle = (low+high)//2
+            name,position = LOOKUP_ENTRY.unpack_from(self.map,LOOKUP_HEADER.size+FANOUT.size+middle*LOOKUP_ENTRY.size)
+            if name < key:
+                low = middle+1
+            elif name > key:
+                high = middle
+            else:
+                return position
+        return None
+
+    def close(self):
+        if isinstance(self.map,mmap.mmap):
+            self.map.close()
+        self.map = b""
+        self.count = 0
+
+    @staticmethod
+    def write(path,names):
+        """Write the table for names, the commit ids in graph position order."""
+        entries = sorted((name,position) for position,name in enumerate(names))
+        fanout = [0]*256
+        for name,_ in entries:
+            fanout[name[0]] += 1
+        total = 0
+        for byte in range(256):
+            total += fanout[byte]
+            fanout[byte] = total
+        import tempfile
+        # A private temp file per writer: processes crossing MAX_UNSORTED together each publish a complete table.
+        fd,tmp_path = tempfile.mkstemp(prefix="tmp_lookup_",dir=os.path.dirname(path) or ".")
+        try:
+            with os.fdopen(fd,"wb") as file:
+                file.write(LOOKUP_HEADER.pack(LOOKUP_SIGNATURE,LOOKUP_VERSION,len(entries),names[-1] if names else bytes(20)))
+                file.write(FANOUT.pack(*fanout))
+                file.write(b"".join(LOOKUP_ENTRY.pack(name,position) for name,position in entries))
+            os.replace(tmp_path,path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+class CommitGraph:
+    def __init__(self,path):
+        self.path = path
+        self.map = b""
+        self.count = 0
+        self.appended = []
+        self.unsorted = None
+        if os.path.exists(path) and os.path.getsize(path) > HEADER.size:
+            with open(path,"rb") as file:
+                self.map = mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ)
+            signature,version = HEADER.unpack_from(self.map,0)
+            if signature != GRAPH_SIGNATURE or version != GRAPH_VERSION:
+                raise Exception(f"Unsupported commit-graph file : {path}")
+            self.count = (len(self.map)-HEADER.size)//RECORD.size
+        self.lookup = CommitLookup(path+".lookup")
+        if self.lookup.count > self.count or (self.lookup.count and self.lookup.last != self.record(self.lookup.count-1)[0]):
+            # The graph was rewritten under the table; fall back to the dict until it is rebuilt.
+            self.lookup.close()
+
+    def __len__(self):
+        return self.count + len(self.appended)
+
+    def __contains__(self,sha1):
+        return self.position(sha1) is not None
+
+    def record(self,position):
+        if position < self.count:
+            return RECORD.unpack_from(self.map,HEADER.size+position*RECORD.size)
+        return self.appended[position-self.count]
+
+    def position(self,sha1):
+        key = bytes.fromhex(sha1)
+        position = self.lookup.find(key)
+        if position is not None:
+            return position
+        if self.unsorted is None:
+            self.unsorted = {self.record(position)[0]:position for position in range(self.lookup.count,len(self))}
+            self.update_lookup()
+        return self.unsorted.get(key)
+
+    def update_lookup(self):
+        """Fold the unsorted tail into a rewritten sorted table once it grows past MAX_UNSORTED."""
+        if self.unsorted is None or len(self.unsorted) <= MAX_UNSORTED:
+            return
+        self.lookup.close()
+        CommitLookup.write(self.lookup.path,[self.record(position)[0] for position in range(len(self))])
+        self.lookup = CommitLookup(self.lookup.path)
+        self.unsorted = {}
+
+    def sha1(self,position):
+        return self.record(position)[0].hex()
+
+    def parent_positions(self,position):
+        _,parent,merged_parent,_,_ = self.record(position)
+        return [parent_position for parent_position in (parent,merged_parent) if parent_position != NO_PARENT]
+
+    def parents(self,sha1):
+        return [self.sha1(position) for position in self.parent_positions(self.position(sha1))]
+
+    def append(self,sha1,parents,date):
+        position = self.append_record(sha1,parents,date)
+        self.update_lookup()
+        return position
+
+    def append_record(self,sha1,parents,date):
+        if sha1 in self:
+            return self.position(sha1)
+        parent_positions = []
+        for parent in parents:
+            parent_position = self.position(parent)
+            if parent_position is None:
+                raise Exception(f"Parent commit {parent} is not in the commit-graph")
+            parent_positions.append(parent_position)
+        generation = 1 + max((self.record(position)[3] for position in parent_positions),default=0)
+        parent_positions += [NO_PARENT]*(2-len(parent_positions))
+        record = (bytes.fromhex(sha1),parent_positions[0],parent_positions[1],generation,int(date))
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) < HEADER.size
+        with open(self.path,"ab") as file:
+            if new_file:
+                file.truncate(0)
+                file.write(HEADER.pack(GRAPH_SIGNATURE,GRAPH_VERSION))
+            elif (file.tell()-HEADER.size) % RECORD.size:
+                file.truncate(file.tell()-(file.tell()-HEADER.size) % RECORD.size)
+            file.write(RECORD.pack(*record))
+        self.appended.append(record)
+        self.unsorted[record[0]] = len(self)-1
+        return len(self)-1
+
+    def ensure(self,tips,read_parents):
+        pending = [tip for tip in tips if tip and tip not in self]
+        missing = []
+        seen = set()
+        while pending:
+            sha1 = pending.pop()
+            if sha1 in seen:
+                continue
+            seen.add(sha1)
+            parents,date = read_parents(sha1)
+            missing.append((sha1,parents,date))
+            pending.extend(parent for parent in parents if parent not in seen and parent not in self)
+        missing.reverse()
+        added = {}
+        while missing:
+            remaining = []
+            for sha1,parents,date in missing:
+                if all(parent in added or parent in self for parent in parents):
+                    self.append_record(sha1,parents,date)
+                    added[sha1] = True
+                else:
+                    remaining.append((sha1,parents,date))
+            if len(remaining) == len(missing):
+                raise Exception("Commit history contains a cycle")
+            missing = remaining
+        self.update_lookup()
+
+    def is_ancestor(self,ancestor,descendant):
+        target = self.position(ancestor)
+        start = self.position(descendant)
+        if target is None or start is None:
+            return False
+        target_generation = self.record(target)[3]
+        stack = [start]
+        seen = set()
+        while stack:
+            position = stack.pop()
+            if position == target:
+                return True
+            if position in seen or self.record(position)[3] <= target_generation:
+                continue
+            seen.add(position)
+            stack.extend(self.parent_positions(position))
+        return False
+
+    def merge_base(self,commit_a,commit_b):
+        position_a = self.position(commit_a)
+        position_b = self.position(commit_b)
+        if position_a is None or position_b is None:
+            return None
+        if position_a == position_b:
+            return commit_a
+        flags = {position_a:1,position_b:2}
+        heap = [(-self.record(position_a)[3],position_a),(-self.record(position_b)[3],position_b)]
+        heapq.heapify(heap)
+        while heap:
+            _,position = heapq.heappop(heap)
+            if flags[position] == 3:
+                return self.sha1(position)
+            for parent in self.parent_positions(position):
+                parent_flags = flags.get(parent,0)
+                if parent_flags | flags[position] != parent_flags:
+                    flags[parent] = parent_flags | flags[position]
+                    heapq.heappush(heap,(-self.record(parent)[3],parent))
+        return None
@@ -0,0 +1,280 @@
+import os
+import io
+import sys
+import json
+import struct
+import socket
+import select
+import signal
+import helpers
+
+SOCKET_PATH = os.path.join(".microgit","daemon.sock")
+DAEMON_COMMANDS = ("status","add","diff")
+CONNECT_TIMEOUT = 0.5
+READ_SIZE = 64*1024
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+LISTING_EVENTS = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT = struct.Struct("iIII")
+
+class Watcher:
+    """Caches stat results of the working tree between requests."""
+    def __init__(self):
+        self.stats = {}
+
+    def cacheable(self,path):
+        return not (os.path.isabs(path) or path == ".." or path.startswith(".."+os.sep)
+                    or path == helpers.GIT_DIR or path.startswith(helpers.GIT_DIR+os.sep))
+
+    def stat(self,filename):
+        path = os.path.normpath(filename)
+        if not self.cacheable(path):
+            return os.stat(filename)
+        if path not in self.stats:
+            try:
+                self.stats[path] = os.stat(path)
+            except FileNotFoundError:
+                self.stats[path] = None
+        result = self.stats[path]
+        if result is None:
+            raise FileNotFoundError(2,"No such file or directory",filename)
+        return result
+
+    def invalidate(self):
+        self.stats.clear()
+
+    def refresh(self):
+        self.invalidate()
+
+    def fileno(self):
+        return None
+
+    def close(self):
+        pass
+
+class PollingWatcher(Watcher):
+    """Fallback when inotify is unavailable: re-stat on every request, keeping only the object and index caches warm."""
+    name = "polling"
+
+class InotifyWatcher(Watcher):
+    name = "inotify"
+
+    def __init__(self,root="."):
+        super().__init__()
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(),"inotify_init1 failed")
+        self.root = root
+        self.watches = {}
+        self.dirty = set()
+        self.rescan = False
+        self.watch_tree(root)
+
+    def add_watch(self,directory):
+        import ctypes
+        wd = self.libc.inotify_add_watch(self.fd,os.fsencode(directory),WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(),f"inotify_add_watch failed for {directory}")
+        self.watches[wd] = os.path.normpath(directory)
+
+    def watch_tree(self,top):
+        for root,dirs,_ in os.walk(top):
+            dirs[:] = [directory for directory in dirs if directory != helpers.GIT_DIR]
+            self.add_watch(root)
+
+    def fileno(self):
+        return self.fd
+
+    def drain(self):
+        while True:
+            try:
+                data = os.read(self.fd,READ_SIZE)
+            except BlockingIOError:
+                return
+            pos = 0
+            while pos < len(data):
+                wd,mask,_,length = EVENT.unpack_from(data,pos)
+                name = data[pos+EVENT.size:pos+EVENT.size+length].rstrip(b"\0")
+                pos += EVENT.size+length
+                self.handle(wd,mask,os.fsdecode(name))
+
+    def handle(self,wd,mask,name):
+        if mask & IN_Q_OVERFLOW:
+            self.rescan = True
+            return
+        directory = self.watches.get(wd)
+        if mask & IN_IGNORED:
+            self.watches.pop(wd,None)
+            return
+        if directory is None:
+            return
+        if mask & IN_ISDIR and mask & (IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE | IN_MOVE_SELF | IN_DELETE_SELF):
+            # Renamed or removed directories leave stale watch paths behind; rebuild them.
+            self.rescan = True
+            return
+        path = os.path.normpath(os.path.join(directory,name)) if name else directory
+        self.dirty.add(path)
+        if name and mask & LISTING_EVENTS:
+            # The directory's own mtime changes with its entries, which is what the ignore walker validates against.
+            self.dirty.add(directory)
+        if mask & IN_ISDIR and mask & IN_CREATE:
+            self.watch_tree(path)
+
+    def refresh(self):
+        self.drain()
+        if self.rescan:
+            self.rescan = False
+            self.dirty.clear()
+            self.invalidate()
+            self.watch_tree(self.root)
+            return
+        for path in self.dirty:
+            self.stats.pop(path,None)
+        self.dirty.clear()
+
+    def close(self):
+        os.close(self.fd)
+
+def create_watcher(poll=False):
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher()
+        except OSError as ex:
+            print(f"inotify unavailable ({ex}), falling back to polling")
+    return PollingWatcher()
+
+def execute(run_argv,argv):
+    output = io.BytesIO()
+    stdout = sys.stdout
+    sys.stdout = io.TextIOWrapper(output,encoding=stdout.encoding or "utf-8",write_through=True)
+    error = None
+    try:
+        run_argv(argv)
+    except Exception as ex:
+        error = str(ex)
+    except SystemExit as ex:
+        error = None if not ex.code else str(ex.code)
+    finally:
+        sys.stdout.flush()
+        sys.stdout.detach()
+        sys.stdout = stdout
+    return output.getvalue(),error
+
+def serve(run_argv,poll=False):
+    try:
+        if not os.path.isdir(helpers.GIT_DIR):
+            raise Exception("Not a microgit repository (run 'init' first)")
+        if ping():
+            raise Exception(f"A daemon is already serving {SOCKET_PATH}")
+        if os.path.exists(SOCKET_PATH):
+            os.remove(SOCKET_PATH)
+        watcher = create_watcher(poll)
+        server = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        server.bind(SOCKET_PATH)
+        server.listen()
+        helpers.watcher = watcher
+        signal.signal(signal.SIGTERM,lambda *_: sys.exit(0))
+        print(f"Watching {os.getcwd()} with {watcher.name}, serving {', '.join(DAEMON_COMMANDS)} on {SOCKET_PATH}")
+        sys.stdout.flush()
+        try:
+            sources = [server] + ([watcher] if watcher.fileno() is not None else [])
+            running = True
+            while running:
+                readable,_,_ = select.select(sources,[],[])
+                if watcher in readable:
+                    watcher.drain()
+                if server not in readable:
+                    continue
+                connection,_ = server.accept()
+                with connection:
+                    with connection.makefile("rb") as reader:
+                        request = json.loads(reader.readline() or b"{}")
+                    if request.get("stop"):
+                        running = False
+                        output,error = b"",None
+                    elif request.get("ping"):
+                        output,error = b"",None
+                    else:
+                        watcher.refresh()
+                        helpers.revalidate_caches()
+                        output,error = execute(run_argv,request["argv"])
+                    connection.sendall(json.dumps({"error":error,"length":len(output)}).encode()+b"\n"+output)
+        finally:
+            helpers.watcher = None
+            server.close()
+            watcher.close()
+            if os.path.exists(SOCKET_PATH):
+                os.remove(SOCKET_PATH)
+    except Exception as ex:
+        raise ex
+
+def connect():
+    client = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    try:
+        client.settimeout(CONNECT_TIMEOUT)
+        client.connect(SOCKET_PATH)
+        client.settimeout(None)
+        return client
+    except BaseException:
+        client.close()
+        raise
+
+def send(client,request):
+    try:
+        client.sendall(json.dumps(request).encode()+b"\n")
+        with client.makefile("rb") as reader:
+            header = reader.readline()
+            response = json.loads(header) if header else None
+            output = reader.read(response["length"]) if response else b""
+        if response is None or len(output) != response["length"]:
+            raise Exception("Lost connection to the microgit daemon")
+        return output,response["error"]
+    finally:
+        client.close()
+
+def ping():
+    try:
+        send(connect(),{"ping":True})
+        return True
+    except Exception:
+        return False
+
+def stop():
+    try:
+        if not os.path.exists(SOCKET_PATH) or not ping():
+            raise Exception("No daemon is running")
+        send(connect(),{"stop":True})
+        print("Daemon stopped")
+    except Exception as ex:
+        raise ex
+
+def forward(argv):
+    """Run argv on a running daemon; returns False when none accepts the connection so the caller can run it locally."""
+    try:
+        client = connect()
+    except OSError:
+        return False
+    output,error = send(client,{"argv":argv})
+    sys.stdout.buffer.write(output)
+    sys.stdout.flush()
+    if error is not None:
+        raise Exception(error)
+    return True
@@ -0,0 +1,144 @@
+BINARY_SNIFF_SIZE = 8000
+CONTEXT_LINES = 3
+
+def is_binary(content):
+    return b"\0" in content[:BINARY_SNIFF_SIZE]
+
+def intern_lines(lines_a,lines_b):
+    table = {}
+    return [table.setdefault(line,len(table)) for line in lines_a],[table.setdefault(line,len(table)) for line in lines_b]
+
+def add_block(blocks,start_a,start_b,length):
+    if length <= 0:
+        return
+    if blocks:
+        last_a,last_b,last_length = blocks[-1]
+        if last_a+last_length == start_a and last_b+last_length == start_b:
+            blocks[-1] = (last_a,last_b,last_length+length)
+            return
+    blocks.append((start_a,start_b,length))
+
+def middle_snake(a,low_a,high_a,b,low_b,high_b):
+    n = high_a-low_a
+    m = high_b-low_b
+    delta = n-m
+    odd = delta & 1
+    max_d = (n+m+1)//2
+    offset = max_d+1
+    forward = [0]*(2*offset+1)
+    backward = [0]*(2*offset+1)
+    for d in range(max_d+1):
+        for k in range(-d,d+1,2):
+            if k == -d or (k != d and forward[offset+k-1] < forward[offset+k+1]):
+                x = forward[offset+k+1]
+            else:
+                x = forward[offset+k-1]+1
+            y = x-k
+            start_x,start_y = x,y
+            while x < n and y < m and a[low_a+x] == b[low_b+y]:
+                x += 1
+                y += 1
+            forward[offset+k] = x
+            c = delta-k
+            if odd and -(d-1) <= c <= d-1 and x+backward[offset+c] >= n:
+                return low_a+start_x,low_b+start_y,low_a+x,low_b+y
+        for c in range(-d,d+1,2):
+            if c == -d or (c != d and backward[offset+c-1] < backward[offset+c+1]):
+                x = backward[offset+c+1]
+            else:
+                x = backward[offset+c-1]+1
+            y = x-c
+            start_x,start_y = x,y
+            while x < n and y < m and a[high_a-1-x] == b[high_b-1-y]:
+                x += 1
+                y += 1
+            backward[offset+c] = x
+            k = delta-c
+            if not odd and -d <= k <= d and x+forward[offset+k] >= n:
+                return high_a-x,high_b-y,high_a-start_x,high_b-start_y
+    raise Exception("Diff failed to find a middle snake")
+
+def myers(a,low_a,high_a,b,low_b,high_b,blocks):
+    prefix = 0
+    while low_a+prefix < high_a and low_b+prefix < high_b and a[low_a+prefix] == b[low_b+prefix]:
+        prefix += 1
+    add_block(blocks,low_a,low_b,prefix)
+    low_a += prefix
+    low_b += prefix
+    suffix = 0
+    while low_a < high_a-suffix and low_b < high_b-suffix and a[high_a-1-suffix] == b[high_b-1-suffix]:
+        suffix += 1
+    high_a -= suffix
+    high_b -= suffix
+    if low_a < high_a and low_b < high_b:
+        start_a,start_b,end_a,end_b = middle_snake(a,low_a,high_a,b,low_b,high_b)
+        myers(a,low_a,start_a,b,low_b,start_b,blocks)
+        add_block(blocks,start_a,start_b,end_a-start_a)
+        myers(a,end_a,high_a,b,end_b,high_b,blocks)
+    add_block(blocks,high_a,high_b,suffix)
+
+def matching_blocks(lines_a,lines_b):
+    """Myers O(ND) line diff; returns difflib-style (a, b, size) blocks ending with a zero-size sentinel."""
+    a,b = intern_lines(lines_a,lines_b)
+    blocks = []
+    myers(a,0,len(a),b,0,len(b),blocks)
+    blocks.append((len(a),len(b),0))
+    return blocks
+
+def opcodes(blocks):
+    position_a = position_b = 0
+    for start_a,start_b,length in blocks:
+        if position_a < start_a and position_b < start_b:
+            yield "replace",position_a,start_a,position_b,start_b
+        elif position_a < start_a:
+            yield "delete",position_a,start_a,position_b,start_b
+        elif position_b < start_b:
+            yield "insert",position_a,start_a,position_b,start_b
+        if length:
+            yield "equal",start_a,start_a+length,start_b,start_b+length
+        position_a,position_b = start_a+length,start_b+length
+
+def diff_stat(lines_a,lines_b):
+    matched = sum(length for _,_,length in matching_blocks(lines_a,lines_b))
+    return len(lines_b)-matched,len(lines_a)-matched
+
+def grouped_opcodes(codes,context=CONTEXT_LINES):
+    codes = list(codes)
+    if not codes:
+        return
+    if codes[0][0] == "equal":
+        tag,i1,i2,j1,j2 = codes[0]
+        codes[0] = tag,max(i1,i2-context),i2,max(j1,j2-context),j2
+    if codes[-1][0] == "equal":
+        tag,i1,i2,j1,j2 = codes[-1]
+        codes[-1] = tag,i1,min(i2,i1+context),j1,min(j2,j1+context)
+    group = []
+    for tag,i1,i2,j1,j2 in codes:
+        if tag == "equal" and i2-i1 > context*2:
+            group.append((tag,i1,i1+context,j1,j1+context))
+            yield group
+            group = []
+            i1,j1 = i2-context,j2-context
+        group.append((tag,i1,i2,j1,j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        yield group
+
+def terminate(line):
+    return line if line.endswith(b"\n") else line+b"\n\\ No newline at end of file\n"
+
+def hunk_range(start,end):
+    return f"{start+1 if end > start else start},{end-start}"
+
+def unified_diff(lines_a,lines_b,context=CONTEXT_LINES):
+    for group in grouped_opcodes(opcodes(matching_blocks(lines_a,lines_b)),context):
+        first,last = group[0],group[-1]
+        yield f"@@ -{hunk_range(first[1],last[2])} +{hunk_range(first[3],last[4])} @@\n".encode()
+        for tag,i1,i2,j1,j2 in group:
+            if tag == "equal":
+                for line in lines_a[i1:i2]:
+                    yield b" "+terminate(line)
+                continue
+            for line in lines_a[i1:i2]:
+                yield b"-"+terminate(line)
+            for line in lines_b[j1:j2]:
+                yield b"+"+terminate(line)
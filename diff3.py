@@ -0,0 +1,58 @@
+from diff import is_binary,matching_blocks
+
+def sync_regions(base,ours,theirs):
+    ours_blocks = matching_blocks(base,ours)
+    theirs_blocks = matching_blocks(base,theirs)
+    regions = []
+    index_ours = index_theirs = 0
+    while index_ours < len(ours_blocks) and index_theirs < len(theirs_blocks):
+        base_ours,match_ours,length_ours = ours_blocks[index_ours]
+        base_theirs,match_theirs,length_theirs = theirs_blocks[index_theirs]
+        start = max(base_ours,base_theirs)
+        end = min(base_ours+length_ours,base_theirs+length_theirs)
+        if start < end:
+            ours_start = match_ours + start - base_ours
+            theirs_start = match_theirs + start - base_theirs
+            regions.append((start,end,ours_start,ours_start+end-start,theirs_start,theirs_start+end-start))
+        if base_ours+length_ours < base_theirs+length_theirs:
+            index_ours += 1
+        else:
+            index_theirs += 1
+    regions.append((len(base),len(base),len(ours),len(ours),len(theirs),len(theirs)))
+    return regions
+
+def merge_lines(base,ours,theirs,ours_label="HEAD",theirs_label="theirs"):
+    """Line-level diff3 over lists of byte lines; returns (merged_lines, conflict_count)."""
+    merged = []
+    conflicts = 0
+    base_pos = ours_pos = theirs_pos = 0
+    for base_start,base_end,ours_start,ours_end,theirs_start,theirs_end in sync_regions(base,ours,theirs):
+        base_chunk = base[base_pos:base_start]
+        ours_chunk = ours[ours_pos:ours_start]
+        theirs_chunk = theirs[theirs_pos:theirs_start]
+        if ours_chunk or theirs_chunk:
+            if ours_chunk == theirs_chunk or theirs_chunk == base_chunk:
+                merged.extend(ours_chunk)
+            elif ours_chunk == base_chunk:
+                merged.extend(theirs_chunk)
+            else:
+                conflicts += 1
+                merged.append(f"<<<<<<< {ours_label}\n".encode())
+                merged.extend(terminate(ours_chunk))
+                merged.append(b"=======\n")
+                merged.extend(terminate(theirs_chunk))
+                merged.append(f">>>>>>> {theirs_label}\n".encode())
+        merged.extend(base[base_start:base_end])
+        base_pos,ours_pos,theirs_pos = base_end,ours_end,theirs_end
+    return merged,conflicts
+
+def terminate(lines):
+    if lines and not lines[-1].endswith(b"\n"):
+        return lines[:-1] + [lines[-1]+b"\n"]
+    return lines
+
+def merge_contents(base,ours,theirs,ours_label="HEAD",theirs_label="theirs"):
+    if is_binary(base) or is_binary(ours) or is_binary(theirs):
+        return ours,1
+    merged,conflicts = merge_lines(base.splitlines(True),ours.splitlines(True),theirs.splitlines(True),ours_label,theirs_label)
+    return b"".join(merged),conflicts
@@ -1,36 +1,125 @@
 import os
 import json
-from datetime import datetime
-import fnmatch
-import zlib
-import configparser
-import hashlib
-import chardet
 import sys
-import shelve
-from collections import deque
+import time
+import heapq
+import indexfile
+import objects
+import refs
+import tracing
 
 GIT_DIR = ".microgit"
+PARALLEL_HASH_THRESHOLD = 64
+CHECKOUT_THREADS = min(32,(os.cpu_count() or 1)*4)
+GC_GRACE_PERIOD = 14*24*60*60
+MIN_ABBREV = 4
 
 def repo_path(*path):
     return os.path.join(".microgit",*path)
 
+# Set by the daemon to a warm filesystem watcher; None means stat the tree directly.
+watcher = None
+
+def stat_path(filename):
+    if watcher:
+        return watcher.stat(filename)
+    return os.stat(filename)
+
+def path_exists(filename):
+    try:
+        stat_path(filename)
+        return True
+    except FileNotFoundError:
+        return False
+
+def path_is_file(filename):
+    try:
+        import stat
+        return stat.S_ISREG(stat_path(filename).st_mode)
+    except FileNotFoundError:
+        return False
+
+loaded_worktree = None
+
+def worktree():
+    """Ignore-aware working tree walker; refreshed once per command so repeated lookups share one walk."""
+    global loaded_worktree
+    if loaded_worktree is None:
+        import ignore
+        loaded_worktree = ignore.Worktree(repo_path(".microgitignore"),stat_path)
+    return loaded_worktree
+
+def refresh_worktree():
+    tree = worktree()
+    tree.refresh()
+    return tree
+
+config_cache = None
+
+def load_config():
+    global config_cache
+    if config_cache is None:
+        tracing.count("config_opens")
+        config_cache = read_config_file()
+    return config_cache
+
+def read_config_file():
+    try:
+        config_path = repo_path("config")
+        if os.path.exists(config_path):
+            with open(config_path,"rb") as file:
+                data = file.read()
+            if b"\0" not in data:
+                config = {}
+                for line in data.decode("utf-8").splitlines():
+                    key,separator,value = line.partition("=")
+                    if separator:
+                        config[key.strip()] = value.strip()
+                return config
+        return migrate_shelve_config()
+    except Exception as ex:
+        raise ex
+
+def migrate_shelve_config():
+    try:
+        if not any(os.path.exists(repo_path("config"+suffix)) for suffix in ("",".db",".dat")):
+            return {}
+        import shelve
+        with shelve.open(repo_path("config"),"r") as config:
+            values = {key:str(value) for key,value in config.items()}
+        save_config(values)
+        return values
+    except Exception as ex:
+        raise ex
+
+def save_config(config):
+    global config_cache
+    try:
+        tmp_path = repo_path(f"config.tmp{os.getpid()}")
+        with open(tmp_path,"w") as file:
+            for key in sorted(config):
+                file.write(f"{key} = {config[key]}\n")
+        os.replace(tmp_path,repo_path("config"))
+        config_cache = dict(config)
+    except Exception as ex:
+        raise ex
+
 def write_to_configfile(key=None,value=None,default=True):
     try:
-        config = shelve.open(repo_path("config"))
+        config = dict(load_config())
         if default:
             config['init.defaultbranch'] = "master"
             config['user.name'] = "user"
             config["user.email"] = "a@a.com"
         else:
             config[key] = value
+        save_config(config)
     except Exception as ex:
         raise ex
     
 def read_from_config(key):
     try:
-        config = shelve.open(repo_path("config"))
-        return config[key]
+        return load_config()[key]
     except Exception as ex:
         raise ex
 
@@ -46,91 +135,468 @@ def init():
             with open(repo_path("HEAD"),"w") as file:
                 main_branch = read_from_config("init.defaultbranch")
                 file.write(f"ref: refs/heads/{main_branch}")
-            index_file_path = repo_path("index")
-            with open(index_file_path,"w") as file:
-                json.dump({},file,indent=4)
+            indexfile.write_index(repo_path("index"),{})
             with open(repo_path(".microgitignore"),"w") as file:
                 file.write("*.py")
             print(f"Initialized Git Repository in the current directory at {os.path.join(os.getcwd(),'.microgit')}")
     except Exception as ex:
         raise ex
     
+def hash_file(filename):
+    try:
+        import hashlib
+        tracing.count("hashes_computed")
+        sha1 = hashlib.sha1()
+        with open(filename,"rb") as file:
+            for chunk in objects.read_chunks(file):
+                tracing.count("bytes_hashed",len(chunk))
+                sha1.update(chunk)
+        return sha1.hexdigest()
+    except Exception as ex:
+        raise ex
+
 def hash_object(filename):
     try:
-        sha1 = None
-        content = None
         if not os.path.exists(filename):
             raise Exception(f"File not found : {filename}")
-        with open(filename,"rb") as file:
-            content = file.read()
-        sha1 = hashlib.sha1(content).hexdigest()
-        if not os.path.exists(repo_path("objects",sha1[:2])):
-            os.makedirs(repo_path("objects",sha1[:2]))
-        with open(repo_path("objects",sha1[:2],sha1[2:]),"wb") as file:
-            file.write(zlib.compress(content))
+        sha1 = hash_file(filename)
+        if not objects.object_exists(sha1):
+            with open(filename,"rb") as file:
+                objects.store_object(sha1,objects.read_chunks(file))
         return sha1
     except Exception as ex:
         raise ex
 
-def cat_file(commit_hash):
+def commit_parents_and_date(sha1):
+    commit_object = objects.read_commit(sha1)
+    return commit_object.parents,commit_timestamp(commit_object.date)
+
+def commit_timestamp(date):
+    from datetime import datetime
+    return datetime.fromisoformat(date).timestamp()
+
+def ref_tips():
+    tips = [get_head()]+[sha1 for _,sha1 in refs.branches()]
+    return [tip for tip in tips if tip]
+
+loaded_graph = None
+loaded_filters = None
+
+def clear_caches():
+    global loaded_graph,loaded_filters,config_cache,index_cache,loaded_worktree
+    objects.clear_caches()
+    refs.clear_cache()
+    loaded_graph = None
+    loaded_filters = None
+    loaded_worktree = None
+    config_cache = None
+    index_cache = None
+
+def file_signature(path):
     try:
-        commit_path = repo_path("objects",commit_hash[:2],commit_hash[2:])
-        if not os.path.exists(commit_path):
-            raise Exception(f"Commit id not found : {commit_hash}")
-        content = None
-        with open(commit_path,"rb") as file:
-            content = zlib.decompress(file.read())
-        return content.decode(chardet.detect(content)['encoding'])
+        stat = os.stat(path)
+        return stat.st_mtime_ns,stat.st_size,stat.st_ino
+    except FileNotFoundError:
+        return None
+
+cache_signatures = {}
+
+def revalidate_caches():
+    """Drop in-process caches whose backing files another process has changed since they were loaded."""
+    global loaded_graph,loaded_filters,config_cache
+    try:
+        for path in (repo_path("commit-graph"),repo_path("changed-paths"),repo_path("config"),repo_path("objects","pack"),repo_path("packed-refs")):
+            signature = file_signature(path)
+            if cache_signatures.get(path,signature) != signature:
+                if path.endswith("commit-graph"):
+                    loaded_graph = None
+                    loaded_filters = None
+                elif path.endswith("changed-paths"):
+                    loaded_filters = None
+                elif path.endswith("config"):
+                    config_cache = None
+                elif path.endswith("packed-refs"):
+                    refs.clear_cache()
+                else:
+                    objects.reload_packs()
+            cache_signatures[path] = signature
+    except Exception as ex:
+        raise ex
+
+def commit_graph(tips=()):
+    """The commit graph, extended with whichever of tips (and their history) it does not contain yet."""
+    global loaded_graph
+    if loaded_graph is None:
+        with tracing.span("commit_graph.load"):
+            import commitgraph
+            loaded_graph = commitgraph.CommitGraph(repo_path("commit-graph"))
+    if tips:
+        loaded_graph.ensure(tips,commit_parents_and_date)
+    return loaded_graph
+
+def changed_paths(sha1):
+    commit_object = objects.read_commit(sha1)
+    parent_tree = commit_tree(objects.read_commit(commit_object.parent)) if commit_object.parent else None
+    return [path for path,_,_ in diff_trees(parent_tree,commit_tree(commit_object))]
+
+def changed_path_filters():
+    """Bloom filters of each commit's changed paths, filled in for commits the graph has but the filter file lacks."""
+    global loaded_filters
+    if loaded_filters is None:
+        import bloom
+        graph = commit_graph()
+        with tracing.span("changed_paths.load"):
+            loaded_filters = bloom.ChangedPathFilters(repo_path("changed-paths"))
+            loaded_filters.ensure(graph,changed_paths)
+    return loaded_filters
+
+def record_changed_paths(sha1,position,paths):
+    try:
+        import bloom
+        filters = loaded_filters if loaded_filters is not None else bloom.ChangedPathFilters(repo_path("changed-paths"))
+        # Only extend a file that is in step with the graph; anything else is caught up lazily by changed_path_filters.
+        if len(filters) == position:
+            filters.add(sha1,paths)
+    except Exception as ex:
+        raise ex
+
+def update_tree(tree_id,changes):
+    try:
+        entries = dict(objects.read_tree(tree_id).entries)
+        subtrees = {}
+        for path,sha1 in changes.items():
+            name,_,rest = path.replace(os.sep,"/").partition("/")
+            if rest:
+                subtrees.setdefault(name,{})[rest] = sha1
+            elif sha1:
+                entries[name] = ("blob",sha1)
+            else:
+                entries.pop(name,None)
+        for name,subtree_changes in subtrees.items():
+            kind,sha1 = entries.get(name,(None,None))
+            subtree_id = update_tree(sha1 if kind == "tree" else None,subtree_changes)
+            if objects.read_tree(subtree_id).entries:
+                entries[name] = ("tree",subtree_id)
+            else:
+                entries.pop(name,None)
+        return objects.write_tree(entries)
+    except Exception as ex:
+        raise ex
+
+def flatten_tree(tree_id,prefix=""):
+    try:
+        files = {}
+        for name,(kind,sha1) in objects.read_tree(tree_id).entries.items():
+            if kind == "tree":
+                files.update(flatten_tree(sha1,prefix+name+"/"))
+            else:
+                files[prefix+name] = sha1
+        return files
+    except Exception as ex:
+        raise ex
+
+def diff_trees(tree_a,tree_b,prefix=""):
+    tracing.count("tree_diffs")
+    if tree_a == tree_b:
+        return
+    entries_a = objects.read_tree(tree_a).entries
+    entries_b = objects.read_tree(tree_b).entries
+    for name in sorted(set(entries_a) | set(entries_b)):
+        if entries_a.get(name) == entries_b.get(name):
+            continue
+        kind_a,sha1_a = entries_a.get(name,(None,None))
+        kind_b,sha1_b = entries_b.get(name,(None,None))
+        if kind_a == "tree" or kind_b == "tree":
+            yield from diff_trees(sha1_a if kind_a == "tree" else None,sha1_b if kind_b == "tree" else None,prefix+name+"/")
+        blob_a = sha1_a if kind_a == "blob" else None
+        blob_b = sha1_b if kind_b == "blob" else None
+        if blob_a != blob_b:
+            yield prefix+name,blob_a,blob_b
+
+def commit_tree(commit_object):
+    try:
+        if isinstance(commit_object.tree,dict):
+            return update_tree(None,commit_object.tree)
+        return commit_object.tree
+    except Exception as ex:
+        raise ex
+
+def tree_blobs(tree_id,visited_trees,blobs):
+    if tree_id in visited_trees:
+        return
+    visited_trees.add(tree_id)
+    for kind,sha1 in objects.read_tree(tree_id).entries.values():
+        if kind == "tree":
+            tree_blobs(sha1,visited_trees,blobs)
+        else:
+            blobs.add(sha1)
+
+def count_tree_files(tree_id,counts=None):
+    counts = {} if counts is None else counts
+    if not tree_id:
+        return 0
+    if tree_id not in counts:
+        counts[tree_id] = sum(count_tree_files(sha1,counts) if kind == "tree" else 1 for kind,sha1 in objects.read_tree(tree_id).entries.values())
+    return counts[tree_id]
+
+def tree_entry(tree_id,path):
+    try:
+        kind,sha1 = "tree",tree_id
+        for name in path.split("/"):
+            if kind != "tree" or not sha1:
+                return None,None
+            kind,sha1 = objects.read_tree(sha1).entries.get(name,(None,None))
+        return kind,sha1
+    except Exception as ex:
+        raise ex
+
+def tree_lookup(tree_id,path):
+    kind,sha1 = tree_entry(tree_id,path)
+    return sha1 if kind == "blob" else None
+
+def remove_path(filename):
+    try:
+        if os.path.exists(filename):
+            os.remove(filename)
+        directory = os.path.dirname(filename)
+        while directory and os.path.isdir(directory) and not os.listdir(directory):
+            os.rmdir(directory)
+            directory = os.path.dirname(directory)
+    except Exception as ex:
+        raise ex
+
+def copy_object_to(sha1,filename):
+    try:
+        directory = os.path.dirname(filename) or "."
+        os.makedirs(directory,exist_ok=True)
+        import tempfile
+        fd,tmp_path = tempfile.mkstemp(prefix=".microgit_tmp_",dir=directory)
+        try:
+            with os.fdopen(fd,"wb") as file:
+                for chunk in objects.read_object_chunks(sha1):
+                    file.write(chunk)
+            os.chmod(tmp_path,0o644)
+            os.replace(tmp_path,filename)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    except Exception as ex:
+        raise ex
+
+index_cache = None
+
+def load_index():
+    global index_cache
+    try:
+        check_if_exist(repo_path("index"))
+        signature = file_signature(repo_path("index"))
+        if index_cache and index_cache[0] == signature:
+            return dict(index_cache[1])
+        tracing.count("index_loads")
+        with tracing.span("index.load"):
+            entries = indexfile.read_index(repo_path("index"))
+        index_cache = (signature,entries)
+        return dict(entries)
+    except Exception as ex:
+        raise ex
+
+def save_index(entries):
+    global index_cache
+    try:
+        tracing.count("index_writes")
+        with tracing.span("index.write",entries=len(entries)):
+            indexfile.write_index(repo_path("index"),entries)
+        index_cache = None
+    except Exception as ex:
+        raise ex
+
+def staged_entries(entries):
+    return {filename:(None if entry.sha1 == indexfile.NULL_SHA1 else entry.sha1) for filename,entry in entries.items() if entry.staged}
+
+def hash_path(filename,entries,write=True):
+    try:
+        try:
+            stat = stat_path(filename)
+        except FileNotFoundError:
+            raise Exception(f"File not found : {filename}")
+        entry = entries.get(filename)
+        if entry and indexfile.stat_matches(entry,stat):
+            if write and not objects.object_exists(entry.sha1):
+                hash_object(filename)
+            return entry.sha1
+        sha1 = hash_object(filename) if write else hash_file(filename)
+        if write or not (entry and entry.staged) or entry.sha1 == sha1:
+            # A staged entry records what will be committed, so a read-only hash must not replace it.
+            entries[filename] = indexfile.entry_from_stat(sha1,stat,entry.staged if entry else False)
+        return sha1
+    except Exception as ex:
+        raise ex
+
+def cat_file(name,output=None):
+    try:
+        try:
+            commit_hash = rev_parse(name)
+        except Exception:
+            raise Exception(f"Commit id not found : {name}")
+        if output:
+            copy_object_to(commit_hash,output)
+            return None
+        return objects.read_blob(commit_hash).data.decode("utf-8",errors="replace")
     except Exception as ex:
         raise ex
     
-def add(filenames):
+def cat_file_batch(lines,out,contents=True):
     try:
-        for index,filename in enumerate(filenames):
-            if filename not in load_gitignore():
-                del filenames[index]
-            if not os.path.exists(filename):
-                raise Exception(f"Fatal error: File '{filename}' does not exist")
-        for filename in filenames:
-            index_file_path = repo_path("index")
-            check_if_exist(index_file_path)
-            index_content = {}
-            with open(index_file_path,"r") as file:
-                index_content = json.load(file)
-            commit_hashes = get_commit_hashes()
-            if hash_object(filename) in commit_hashes:
+        for line in lines:
+            name = line.strip()
+            if not name:
                 continue
-            index_content[filename] = hash_object(filename)
-            with open(index_file_path,"w") as file:
-                json.dump(index_content,file,indent=4)
+            try:
+                sha1 = name if len(name) == 40 and objects.object_exists(name) else rev_parse(name)
+            except Exception:
+                sha1 = None
+            if sha1 is None:
+                out.write(f"{name} missing\n".encode())
+            else:
+                kind,size,content = objects.object_info(sha1)
+                out.write(f"{sha1} {kind} {size}\n".encode())
+                if contents:
+                    if content is not None:
+                        out.write(content)
+                    else:
+                        for chunk in objects.read_object_chunks(sha1):
+                            out.write(chunk)
+                    out.write(b"\n")
+            out.flush()
+    except Exception as ex:
+        raise ex
+
+def hash_object_paths(lines,out):
+    try:
+        for line in lines:
+            filename = line.rstrip("\r\n")
+            if not filename:
+                continue
+            out.write(f"{hash_object(filename)}\n".encode())
+            out.flush()
+    except Exception as ex:
+        raise ex
+
+def resolve_paths(filenames,tracked=()):
+    """Return the files to hash and the tracked paths under filenames that are gone from the working tree."""
+    try:
+        tree = refresh_worktree()
+        paths = {}
+        removed = {}
+        with tracing.span("fs.walk"):
+            for filename in filenames:
+                top = os.path.normpath(filename)
+                if not os.path.exists(filename):
+                    gone = [path for path in tracked if path == top or path.startswith(top+os.sep)]
+                    if not gone:
+                        raise Exception(f"Fatal error: File '{filename}' does not exist")
+                    removed.update(dict.fromkeys(gone,True))
+                elif os.path.isdir(filename):
+                    walked = tree.walk(filename)
+                    paths.update(dict.fromkeys(walked,True))
+                    prefix = "" if top == "." else top+os.sep
+                    # Tracked files that are ignored now are still on disk; only the ones that really vanished are deletions.
+                    candidates = set(path for path in tracked if path.startswith(prefix)).difference(walked)
+                    removed.update(dict.fromkeys((path for path in sorted(candidates) if not path_exists(path)),True))
+                elif not tree.is_ignored(filename,False):
+                    paths[top] = True
+        tracing.count("files_walked",len(paths))
+        return list(paths),list(removed)
+    except Exception as ex:
+        raise ex
+
+@tracing.traced("hash_paths")
+def hash_paths(filenames,entries,jobs=None):
+    try:
+        stats = {}
+        pending = []
+        hashes = {}
+        for filename in filenames:
+            stat = stat_path(filename)
+            entry = entries.get(filename)
+            if entry and indexfile.stat_matches(entry,stat) and objects.object_exists(entry.sha1):
+                hashes[filename] = entry.sha1
+            else:
+                stats[filename] = stat
+                pending.append(filename)
+        jobs = jobs or os.cpu_count() or 1
+        if jobs > 1 and len(pending) >= PARALLEL_HASH_THRESHOLD:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                results = executor.map(hash_object,pending,chunksize=max(1,len(pending)//(jobs*4)))
+                hashes.update(zip(pending,results))
+        else:
+            for filename in pending:
+                hashes[filename] = hash_object(filename)
+        for filename in pending:
+            entry = entries.get(filename)
+            entries[filename] = indexfile.entry_from_stat(hashes[filename],stats[filename],entry.staged if entry else False)
+        return hashes
+    except Exception as ex:
+        raise ex
+
+def add(filenames,jobs=None):
+    try:
+        start = time.perf_counter()
+        index_content = load_index()
+        tracked = head_files()
+        tracked_paths = set(path.replace("/",os.sep) for path in tracked)
+        tracked_paths.update(filename for filename,entry in index_content.items() if entry.sha1 != indexfile.NULL_SHA1)
+        paths,removed = resolve_paths(filenames,tracked_paths)
+        hashes = hash_paths(paths,index_content,jobs)
+        total_bytes = 0
+        for filename in paths:
+            total_bytes += index_content[filename].size or os.path.getsize(filename)
+            # Content identical to HEAD's copy of the same path has nothing to commit.
+            staged = tracked.get(filename.replace(os.sep,"/")) != hashes[filename]
+            index_content[filename] = index_content[filename]._replace(staged=staged)
+        for filename in removed:
+            if filename.replace(os.sep,"/") in tracked:
+                index_content[filename] = indexfile.IndexEntry(indexfile.NULL_SHA1,0,0,0,0,True)
+            else:
+                index_content.pop(filename,None)
+        save_index(index_content)
+        elapsed = max(time.perf_counter()-start,1e-9)
+        megabytes = total_bytes/(1024*1024)
+        print(f"Added {len(paths)} files ({megabytes:.2f} MB) in {elapsed:.2f}s : {len(paths)/elapsed:.1f} files/s, {megabytes/elapsed:.2f} MB/s")
+        if removed:
+            print(f"Staged {len(removed)} deletion(s)")
     except Exception as ex:
         raise ex
     
 def commit(commit_message,parent2=None):
     try:
-        index_file_path = repo_path("index")
         parent = get_head()
-        if not os.path.exists(index_file_path):
-            raise Exception("No index file")
-        with open(index_file_path,"r") as file:
-            index_file_content = json.load(file)
-        if len(index_file_content) == 0:
+        if not parent2 and os.path.exists(repo_path("MERGE_HEAD")):
+            with open(repo_path("MERGE_HEAD"),"r") as file:
+                parent2 = file.read().strip()
+        index_content = load_index()
+        index_file_content = staged_entries(index_content)
+        if len(index_file_content) == 0 and not parent2:
             raise Exception(f"\nOn branch {get_branch_name()}\nNothing to commit. Working tree clean")
+        from datetime import datetime
         user_name= read_from_config("user.name")
         user_email = read_from_config("user.email")
-        commit_content = {"tree":index_file_content,"username":user_name,"email":user_email,"date":datetime.now().isoformat(),"message":commit_message}
+        parent_tree = commit_tree(objects.read_commit(parent)) if parent else None
+        tree = update_tree(parent_tree,index_file_content)
+        commit_content = {"tree":tree,"username":user_name,"email":user_email,"date":datetime.now().isoformat(),"message":commit_message}
         if parent:
             commit_content['parent'] = parent
         if parent2:
             commit_content['merged_parent'] = parent2
-        sha1 = hashlib.sha1(json.dumps(commit_content).encode()).hexdigest()
-        if not os.path.exists(repo_path("objects",sha1[:2])):
-            os.makedirs(repo_path("objects",sha1[:2]))
-        with open(repo_path("objects",sha1[:2],sha1[2:]),"wb") as file:
-            file.write(zlib.compress(json.dumps(commit_content).encode()))
-        with open(index_file_path,"w") as file:
-            json.dump({},file)
-        update_head(sha1)
+        sha1 = objects.write_object(json.dumps(commit_content).encode())
+        position = commit_graph([parent,parent2]).append(sha1,[commit for commit in (parent,parent2) if commit],commit_timestamp(commit_content['date']))
+        record_changed_paths(sha1,position,[path for path,_,_ in diff_trees(parent_tree,tree)])
+        save_index({filename:entry._replace(staged=False) for filename,entry in index_content.items() if entry.sha1 != indexfile.NULL_SHA1})
+        if os.path.exists(repo_path("MERGE_HEAD")):
+            os.remove(repo_path("MERGE_HEAD"))
+        update_head(sha1,f"commit{' (merge)' if parent2 else ''}: {commit_message.splitlines()[0] if commit_message else ''}")
         print(f"Successfully committed files with {sha1} --> {commit_message}")
     except Exception as ex:
         raise ex
@@ -145,116 +611,195 @@ def get_head():
         with open(head_path,"r") as file:
             head_branch = file.read().strip()
         if head_branch.startswith("ref:"):
-            head_branch = head_branch.split()
-            if not os.path.exists(repo_path(head_branch[1])):
-                with open(repo_path(head_branch[1]),"w") as file:
-                    file.write(" ")
-            with open(repo_path(head_branch[1]),"r") as file:
-                head = file.read().strip()
+            head = refs.read_ref(head_branch.split()[1])
+        elif head_branch:
+            head = head_branch
         return head
     except Exception as ex:
         raise ex
 
-def update_head(commit):
+def reflog_identity():
+    return f"{read_from_config('user.name')} <{read_from_config('user.email')}>"
+
+def update_head(commit,message):
     try:
         head_path = repo_path("HEAD")
         with open(head_path,"r") as file:
             head_content = file.read()
+        old = get_head()
         if head_content.startswith("ref:"):
-            head_content = head_content.split()
-            with open(repo_path(head_content[1]),"w") as file:
+            refs.write_ref(head_content.split()[1],commit,message,reflog_identity())
+        else:
+            with open(head_path,"w") as file:
                 file.write(commit)
+        refs.append_reflog("HEAD",old,commit,message,reflog_identity())
+    except Exception as ex:
+        raise ex
+
+def reflog(ref_name="HEAD"):
+    try:
+        ref = ref_name if ref_name == "HEAD" else refs.HEADS_PREFIX+ref_name
+        for position,(_,new,_,_,_,message) in enumerate(reversed(refs.read_reflog(ref))):
+            print(f"{new[:7]} {ref_name}@{{{position}}}: {message}")
     except Exception as ex:
         raise ex
     
-def log(all_parents=False,one_line=False):
-    try:
-        parent_commit = get_head()
-        visited = set()
-        queue = deque([parent_commit])
-        while queue:
-            current_commit = queue.popleft()
-            if current_commit in visited:
-                continue
-            visited.add(current_commit)
-            with open(repo_path("objects",current_commit[:2],current_commit[2:]),"rb") as file:
-                content = zlib.decompress(file.read())
-                content = content.decode(chardet.detect(content)['encoding'])
-                content = json.loads(content)
-                if one_line:
-                    print(f"\n{current_commit} : {content['message']}")
-                else:
-                    print(f"\nCommit : {current_commit}\nDate : {content['date']}\nUser : {content['username']}<{content['email']}>\n")
-                    if 'merged_parent' in content:
-                        print(f"\nMerged : {content['merged_parent']}")
-                    print(f"\n\n{content['message']}")
-
-                if all_parents:
-                    if 'parent' in content:
-                        queue.append(content['parent'])
-                    elif 'merged_parent' in content:
-                        queue.append(content['merged_parent'])
-                else:
-                    if 'parent' in content:
-                        queue.append(content['parent'])
-                
+DATE_UNITS = {"second":1,"minute":60,"hour":60*60,"day":24*60*60,"week":7*24*60*60,"month":30*24*60*60,"year":365*24*60*60}
+
+def parse_date(text):
+    """Accept a unix timestamp, an ISO date or '<n> <unit>s ago' as used by log --since/--until."""
+    if text is None:
+        return None
+    import re
+    value = text.strip().lower()
+    try:
+        if value.isdigit():
+            return int(value)
+        match = re.fullmatch(r"(\d+)[ .]*(second|minute|hour|day|week|month|year)s?[ .]*ago",value)
+        if match:
+            return time.time()-int(match.group(1))*DATE_UNITS[match.group(2)]
+        return commit_timestamp(text.strip())
+    except ValueError:
+        raise Exception(f"Invalid date : {text}")
+
+def log_paths(paths):
+    normalized = []
+    for path in paths or []:
+        path = os.path.normpath(path).replace(os.sep,"/").strip("/")
+        if path in ("","."):
+            return []
+        if path == ".." or path.startswith("../"):
+            raise Exception(f"Path {path} is outside the repository")
+        normalized.append(path)
+    return normalized
+
+def commit_touches_paths(graph,filters,position,paths):
+    candidates = []
+    for path in paths:
+        tracing.count("bloom_queries")
+        if filters.maybe_changed(position,path):
+            candidates.append(path)
+    if not candidates:
+        tracing.count("bloom_skipped_commits")
+        return False
+    commit_object = objects.read_commit(graph.sha1(position))
+    tree = commit_tree(commit_object)
+    parent_tree = commit_tree(objects.read_commit(commit_object.parent)) if commit_object.parent else None
+    if any(tree_entry(tree,path) != tree_entry(parent_tree,path) for path in candidates):
+        return True
+    tracing.count("bloom_false_positives")
+    return False
+
+def log_commits(start,all_parents=False,since=None,until=None,paths=None):
+    """Yield commit ids reachable from start, newest first, lazily so callers can stop after any number of them."""
+    graph = commit_graph([start])
+    filters = changed_path_filters() if paths else None
+    position = graph.position(start)
+    heap = [(-graph.record(position)[4],-position)]
+    seen = {position}
+    while heap:
+        negative_date,negative_position = heapq.heappop(heap)
+        position = -negative_position
+        if since is not None and -negative_date < since:
+            return
+        parents = graph.parent_positions(position)
+        for parent in (parents if all_parents else parents[:1]):
+            if parent not in seen:
+                seen.add(parent)
+                heapq.heappush(heap,(-graph.record(parent)[4],-parent))
+        if until is not None and -negative_date > until:
+            continue
+        if paths and not commit_touches_paths(graph,filters,position,paths):
+            continue
+        yield graph.sha1(position)
+
+def log(all_parents=False,one_line=False,revision="HEAD",max_count=None,since=None,until=None,paths=None):
+    try:
+        if max_count is not None and max_count < 0:
+            raise Exception("log -n needs a non-negative count")
+        start = get_head() if revision == "HEAD" else rev_parse(revision)
+        if not start:
+            return
+        from itertools import islice
+        commits = log_commits(start,all_parents,parse_date(since),parse_date(until),log_paths(paths))
+        for current_commit in islice(commits,max_count):
+            commit_object = objects.read_commit(current_commit)
+            if one_line:
+                print(f"\n{current_commit} : {commit_object.message}")
+            else:
+                print(f"\nCommit : {current_commit}\nDate : {commit_object.date}\nUser : {commit_object.username}<{commit_object.email}>\n")
+                if commit_object.merged_parent:
+                    print(f"\nMerged : {commit_object.merged_parent}")
+                print(f"\n\n{commit_object.message}")
+
     except Exception as ex:
         raise ex
 
-def get_commit_hashes():
+def head_files():
     try:
         head = get_head()
-        commit_hashes = []
-        while head:
-            with open(repo_path("objects",head[:2],head[2:]),"rb") as file:
-                content = zlib.decompress(file.read())
-                content = content.decode(chardet.detect(content)['encoding'])
-                content = json.loads(content)
-                commit_hashes.extend(list(content['tree'].values()))
-                head = content['parent'] if 'parent' in content else None
-        return commit_hashes
+        return flatten_tree(commit_tree(objects.read_commit(head))) if head else {}
     except Exception as ex:
         raise ex
     
-def load_gitignore():
+def worktree_files():
     try:
-        file_list = [file for file in os.listdir() if not os.path.isdir(file)]
-        file_to_ignore = []
-        if os.path.exists(repo_path(".microgitignore")):
-            ignorefilelist = []
-            with open(repo_path(".microgitignore"),"r") as file:
-                ignorefilelist = file.readlines()
-            for file in ignorefilelist:
-                file_to_ignore.extend(fnmatch.filter(file_list,file.strip()))
-        return list(set(file_list) - set(file_to_ignore))
+        with tracing.span("fs.walk"):
+            file_list = refresh_worktree().walk()
+        tracing.count("files_walked",len(file_list))
+        return file_list
     except Exception as ex:
         raise ex
     
 def checkout(commithash_or_branchname):
     try:
-        checkout_to_branch = False
-        if os.path.exists(repo_path("refs","heads",commithash_or_branchname)):
-            with open(repo_path("refs","heads",commithash_or_branchname),"r") as file:
-                commithash = file.read().strip()
-                checkout_to_branch = True
-            with open(repo_path("HEAD"),"w") as file:
-                file.write(f"ref: refs/heads/{commithash_or_branchname}")
-        else:
-            commithash = commithash_or_branchname   
-        if not os.path.exists(repo_path("objects",commithash[:2],commithash[2:])):
-            raise Exception(f"Commit hash or branch not found : {commithash_or_branchname}")
-        with open(repo_path("objects",commithash[:2],commithash[2:]),"rb") as file:
-            content = zlib.decompress(file.read())
-            content = content.decode(chardet.detect(content)['encoding'])
-            content = json.loads(content)
-        all_files = load_gitignore()
-        for file in all_files:
-            if file not in list(content['tree'].keys()):
-                os.remove(file)
-        for filename,commit in content['tree'].items():
-            with open(filename,"w") as f_out:
-                f_out.write(cat_file(commit))
-        print(f"Switched to {'commit' if not checkout_to_branch else 'branch'} {commithash_or_branchname}")
+        current_commit = get_head()
+        commithash = refs.read_branch(commithash_or_branchname)
+        checkout_to_branch = commithash is not None
+        if not checkout_to_branch:
+            try:
+                commithash = rev_parse(commithash_or_branchname)
+            except Exception:
+                raise Exception(f"Commit hash or branch not found : {commithash_or_branchname}")
+        current_tree = commit_tree(objects.read_commit(current_commit)) if current_commit else None
+        target_tree = commit_tree(objects.read_commit(commithash))
+        index_content = load_index()
+        to_remove = []
+        to_write = []
+        for filename,old_commit,commit in diff_trees(current_tree,target_tree):
+            if os.path.isfile(filename):
+                current = hash_path(filename,index_content,write=False)
+                if current not in (old_commit,commit):
+                    raise Exception(f"Your local changes to '{filename}' would be overwritten by checkout. Commit or reset them first")
+                if current == commit:
+                    continue
+            if commit is None:
+                to_remove.append(filename)
+            else:
+                to_write.append((filename,commit))
+        for filename in to_remove:
+            remove_path(filename)
+            index_content.pop(filename,None)
+        objects.packs()
+
+        def write_file(item):
+            filename,commit = item
+            copy_object_to(commit,filename)
+            return filename,commit,os.stat(filename)
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=CHECKOUT_THREADS) as executor:
+            for filename,commit,stat in executor.map(write_file,to_write):
+                entry = index_content.get(filename)
+                index_content[filename] = indexfile.entry_from_stat(commit,stat,entry.staged if entry else False)
+        # HEAD moves only once the working tree matches the target, so a failed write leaves HEAD on the old commit.
+        previous = get_branch_name()
+        with open(repo_path("HEAD"),"w") as file:
+            file.write(f"ref: {refs.HEADS_PREFIX}{commithash_or_branchname}" if checkout_to_branch else commithash)
+        refs.append_reflog("HEAD",current_commit,commithash,f"checkout: moving from {previous} to {commithash_or_branchname}",reflog_identity())
+        save_index(index_content)
+        skipped = count_tree_files(target_tree) - len(to_write)
+        print(f"Switched to {'commit' if not checkout_to_branch else 'branch'} {commithash_or_branchname} ({len(to_write)} files written, {len(to_remove)} removed, {skipped} unchanged)")
     except Exception as ex:
         raise ex
     
@@ -263,16 +808,16 @@ def branch(branch_name):
         if branch_name is None:
             if not os.path.exists(repo_path("refs","heads")):
                 raise Exception("branch path (refs/heads) not found")
-            with open(repo_path("HEAD"),"r") as file:
-                head_branch_name = file.read().strip().split()[1]
-                head_branch_name = head_branch_name.split("/")[2] if "/" in head_branch_name else None
-            for files in os.listdir(repo_path("refs","heads")):
-                    print(f"{'* ' if files == head_branch_name else ''}{files}")
+            head_branch_name = get_branch_name()
+            for name,_ in refs.branches():
+                    print(f"{'* ' if name == head_branch_name else ''}{name}")
         else:
+            refs.check_branch_name(branch_name)
             head = get_head()
-            if not os.path.exists(repo_path("refs","heads",branch_name)):
-                with open(repo_path("refs","heads",branch_name),"w") as file:
-                    file.write(head)
+            if refs.read_branch(branch_name) is None:
+                if not head:
+                    raise Exception(f"Cannot create branch '{branch_name}' before the first commit")
+                refs.write_ref(refs.HEADS_PREFIX+branch_name,head,"branch: Created from HEAD",reflog_identity())
                 print(f"Created branch '{branch_name}'")
             else:
                 print(f"Branch {branch_name} already exists")
@@ -286,37 +831,54 @@ def get_branch_name():
             raise Exception("HEAD file not found")
         with open(repo_path("HEAD"),"r") as file:
             content = file.read().split()
-            branch_name = content[1].split("/")[2]
+        if content and content[0] == "ref:":
+            branch_name = content[1][len(refs.HEADS_PREFIX):] if content[1].startswith(refs.HEADS_PREFIX) else content[1]
+        elif content:
+            branch_name = f"(HEAD detached at {content[0][:7]})"
         return branch_name
     except Exception as ex:
         raise ex
 def status():
     try:
-        staged_files = {}
         to_be_staged_files = []
         unstaged_files = []
         print(f"On branch {get_branch_name()}")
-        if not os.path.exists(repo_path("index")):
-            raise Exception("No index file")
-        with open(repo_path("index"),"r") as file:
-            staged_files = json.load(file)
+        index_content = load_index()
+        cached_entries = dict(index_content)
+        staged_files = staged_entries(index_content)
         if len(staged_files) > 0:
             print("\nStaged changes\n---------------------------------------")
             for files in staged_files:
                 print(files)
             for file,commit_hash in staged_files.items():
-                if commit_hash != hash_object(file):
+                if commit_hash is None:
+                    continue
+                if not path_exists(file):
+                    to_be_staged_files.append(f"Deleted : {file}")
+                elif commit_hash != hash_path(file,index_content,write=False):
                     to_be_staged_files.append(f"Modified : {file}")
-            if len(to_be_staged_files) > 0:
-                print("\nChanges to be staged\n---------------------------------------------")
-                for files in to_be_staged_files:
-                    print(files)
 
-        file_commits = get_commit_hashes()
-        files = file_list()
+        tracked = head_files()
+        files = worktree_files()
         for file in files:
-            if hash_object(file) not in file_commits and file not in staged_files:
+            if file in staged_files:
+                continue
+            head_sha1 = tracked.get(file.replace(os.sep,"/"))
+            if head_sha1 is None:
                 unstaged_files.append(file)
+            elif hash_path(file,index_content,write=False) != head_sha1:
+                to_be_staged_files.append(f"Modified : {file}")
+        worktree_set = set(files)
+        for file in sorted(tracked):
+            path = file.replace("/",os.sep)
+            if path not in staged_files and path not in worktree_set and not path_exists(path):
+                to_be_staged_files.append(f"Deleted : {path}")
+        if index_content != cached_entries:
+            save_index(index_content)
+        if len(to_be_staged_files) > 0:
+            print("\nChanges to be staged\n---------------------------------------------")
+            for files in to_be_staged_files:
+                print(files)
         if len(unstaged_files) > 0:
             print("\nUntracked files(use microgit.py add <filename> to add)\n----------------------------------")
             for files in unstaged_files:
@@ -335,50 +897,74 @@ def check_if_exist(*path):
     
 def merge(branch_name):
     try:
-        check_if_exist(repo_path("refs","heads",branch_name))
-        if check_if_exist(repo_path("HEAD")):
-            head_branch_commit = get_head()
-        merge_branch_commit = None
-        with open(repo_path("refs","heads",branch_name),"r") as file:
-            merge_branch_commit = file.read().strip()
-        head_branch_files = []
-        files_to_merge = []
+        check_if_exist(repo_path("HEAD"))
+        head_branch_commit = get_head()
+        merge_branch_commit = rev_parse(branch_name)
+        for commit_hash in (head_branch_commit,merge_branch_commit):
+            if not objects.object_exists(commit_hash):
+                raise Exception(f"Fatal Error : commit '{commit_hash}' does not exist")
+        import diff3
+        graph = commit_graph([head_branch_commit,merge_branch_commit])
+        if graph.is_ancestor(merge_branch_commit,head_branch_commit):
+            print(f"Already up to date with branch '{branch_name}'")
+            return
+        # When HEAD is behind the branch there is nothing to combine: move HEAD forward without a merge commit.
+        fast_forward = graph.is_ancestor(head_branch_commit,merge_branch_commit)
+        base_commit = head_branch_commit if fast_forward else graph.merge_base(head_branch_commit,merge_branch_commit)
+        head_tree = commit_tree(objects.read_commit(head_branch_commit))
+        merge_tree = commit_tree(objects.read_commit(merge_branch_commit))
+        base_tree = commit_tree(objects.read_commit(base_commit)) if base_commit else None
+        index_content = load_index()
+        changes = []
+        for filename,head_hash,branch_hash in diff_trees(head_tree,merge_tree):
+            base_hash = tree_lookup(base_tree,filename)
+            if branch_hash == base_hash:
+                continue
+            if os.path.isfile(filename) and hash_path(filename,index_content,write=False) != head_hash:
+                raise Exception(f"Your local changes to '{filename}' would be overwritten by merge. Commit or reset them first")
+            changes.append((filename,head_hash,branch_hash,base_hash))
+        # Every path has passed the local-changes check; only now is the working tree touched.
         merge_list = {}
-        check_if_exist(repo_path("objects",head_branch_commit[:2],head_branch_commit[2:]))
-        with open(repo_path("objects",head_branch_commit[:2],head_branch_commit[2:]),"rb") as file:
-            content = zlib.decompress(file.read())
-            content = content.decode(chardet.detect(content)['encoding'])
-            content = json.loads(content)
-            head_branch_files = content['tree']
-        check_if_exist(repo_path("objects",merge_branch_commit[:2],merge_branch_commit[2:]))
-        with open(repo_path("objects",merge_branch_commit[:2],merge_branch_commit[2:]),"rb") as file:
-            content = zlib.decompress(file.read())
-            content = content.decode(chardet.detect(content)['encoding'])
-            content = json.loads(content)
-            files_to_merge = content['tree']
-        all_files = set(head_branch_files.keys()) | set(files_to_merge.keys())
-        for filename in all_files:
-            head_hash = head_branch_files.get(filename,None)
-            branch_hash = files_to_merge.get(filename,None)
-            if head_hash == branch_hash:
-                merge_list[filename] = head_hash
-            elif not head_hash and branch_hash:
+        conflicts = []
+        conflict_contents = {}
+        for filename,head_hash,branch_hash,base_hash in changes:
+            if head_hash == base_hash:
                 merge_list[filename] = branch_hash
-            elif head_hash and not branch_hash:
-                merge_list[filename] = head_hash
+            elif head_hash is None or branch_hash is None:
+                conflicts.append((filename,"modify/delete"))
             else:
-                content = "\n<<<<<<<<<<<<<<<<<<<<<<<<<<<<<HEAD\n"+cat_file(head_hash)+"\n===========================\n"+cat_file(branch_hash)+f"\n>>>>>>>>>>>>>>>>>>>>>>>>>>>{branch_name}\n"
-                with open(filename,"w") as file:
-                    file.write(content)
-                print(f"Conflict detected in file '{filename}' while merging branch '{branch_name}'.\nPlease resolve it manually before merging.")
-                sys.exit()
-        index_file = {}
+                merged,conflict_count = diff3.merge_contents(objects.read_blob(base_hash).data if base_hash else b"",objects.read_blob(head_hash).data,
+                                                               objects.read_blob(branch_hash).data,"HEAD",branch_name)
+                if conflict_count:
+                    conflict_contents[filename] = merged
+                    conflicts.append((filename,"content"))
+                else:
+                    merge_list[filename] = objects.write_object(merged)
+        for filename,merged in conflict_contents.items():
+            with open(filename,"wb") as file:
+                file.write(merged)
         for filename,commit_hash in merge_list.items():
-            with open(filename,"w") as file:
-                file.write(cat_file(commit_hash))
-            index_file[filename] = commit_hash
-        with open(repo_path("index"),"w") as file:
-            json.dump(index_file,file,indent=4)
+            if commit_hash is None:
+                remove_path(filename)
+                if fast_forward:
+                    index_content.pop(filename,None)
+                else:
+                    index_content[filename] = indexfile.IndexEntry(indexfile.NULL_SHA1,0,0,0,0,True)
+                continue
+            copy_object_to(commit_hash,filename)
+            index_content[filename] = indexfile.entry_from_stat(commit_hash,os.stat(filename),not fast_forward)
+        if fast_forward:
+            update_head(merge_branch_commit,f"merge {branch_name}: Fast-forward")
+            save_index(index_content)
+            print(f"Fast-forwarded to branch '{branch_name}'")
+            return
+        save_index(index_content)
+        if conflicts:
+            with open(repo_path("MERGE_HEAD"),"w") as file:
+                file.write(merge_branch_commit)
+            for filename,kind in conflicts:
+                print(f"CONFLICT ({kind}): Merge conflict in {filename}")
+            raise Exception(f"Automatic merge of branch '{branch_name}' failed with {len(conflicts)} conflict(s); fix them, add the files and commit the result")
         commit(f"Merged branch '{branch_name}'",parent2=merge_branch_commit)
         print(f"Successfully Merged feature branch '{branch_name}'")
     except Exception as ex:
@@ -386,20 +972,325 @@ def merge(branch_name):
 
 def reset(files):
     try:
-        index_content = {}
-        if check_if_exist(repo_path("index")):
-            with open(repo_path("index"),"r") as file:
-                index_content = json.load(file)
-            for filename in files:
-                if filename not in load_gitignore():
-                    raise Exception(f"Fatal error: file '{filename}' not found")
-            for filename in list(filter(lambda file:file in index_content,files)):
-                if check_if_exist(repo_path("objects",index_content[filename][:2],index_content[filename][2:])):
-                    os.remove(repo_path("objects",index_content[filename][:2],index_content[filename][2:]))
-                    os.rmdir(repo_path("objects",index_content[filename][:2]))
+        index_content = load_index()
+        worktree_list = set(worktree_files())
+        for filename in files:
+            # Staged deletions have no file left in the working tree but can still be unstaged.
+            if filename not in worktree_list and not (filename in index_content and index_content[filename].staged):
+                raise Exception(f"Fatal error: file '{filename}' not found")
+        head = get_head()
+        head_tree = commit_tree(objects.read_commit(head)) if head else None
+        for filename in list(filter(lambda file:file in index_content and index_content[file].staged,files)):
+            # Objects stay in the store: other commits may share them and gc prunes whatever is left unreachable.
+            head_sha1 = tree_lookup(head_tree,filename.replace(os.sep,"/")) if head_tree else None
+            if head_sha1:
+                index_content[filename] = indexfile.IndexEntry(head_sha1,0,0,0,0,False)
+            else:
                 del index_content[filename]
-                print(f"Unstaged '{filename}'")
-            with open(repo_path("index"),"w") as file:
-                json.dump(index_content,file,indent=4)
+            print(f"Unstaged '{filename}'")
+        save_index(index_content)
+    except Exception as ex:
+        raise ex
+
+def loose_objects():
+    objects_dir = repo_path("objects")
+    for fanout in sorted(os.listdir(objects_dir)):
+        if len(fanout) != 2 or not os.path.isdir(os.path.join(objects_dir,fanout)):
+            continue
+        for name in sorted(os.listdir(os.path.join(objects_dir,fanout))):
+            if len(name) == 38:
+                yield fanout+name
+
+def repack():
+    try:
+        loose = list(loose_objects())
+        existing_packs = objects.packs()
+        if not loose and len(existing_packs) <= 1:
+            print("Nothing to repack")
+            return
+        pack_objects = {}
+        for object_pack in existing_packs:
+            for sha1 in object_pack.index.names():
+                pack_objects[sha1] = (sha1,object_pack.object_size(sha1),lambda sha1=sha1,object_pack=object_pack:object_pack.read_chunks(sha1))
+        for sha1 in loose:
+            if sha1 not in pack_objects:
+                pack_objects[sha1] = (sha1,objects.object_size(sha1),lambda sha1=sha1:objects.read_object_chunks(sha1))
+        import pack
+        pack_dir = repo_path("objects","pack")
+        pack_name,deltas = pack.write_pack(pack_dir,list(pack_objects.values()))
+        old_packs = [object_pack.pack_path for object_pack in existing_packs]
+        objects.reload_packs()
+        for pack_path in old_packs:
+            if os.path.basename(pack_path) != pack_name+".pack":
+                os.remove(pack_path[:-len(".pack")]+".idx")
+                os.remove(pack_path)
+        for sha1 in loose:
+            os.remove(objects.object_path(sha1))
+            if not os.listdir(repo_path("objects",sha1[:2])):
+                os.rmdir(repo_path("objects",sha1[:2]))
+        print(f"Packed {len(pack_objects)} objects ({deltas} deltas) into {pack_name}")
+    except Exception as ex:
+        raise ex
+
+def reachable_objects():
+    try:
+        roots = set(ref_tips())
+        if os.path.exists(repo_path("MERGE_HEAD")):
+            with open(repo_path("MERGE_HEAD"),"r") as file:
+                roots.add(file.read().strip())
+        # Reflog entries keep recently abandoned commits recoverable, as long as they still exist.
+        for ref in ["HEAD"]+[refs.HEADS_PREFIX+name for name,_ in refs.branches()]:
+            roots.update(new for _,new,_,_,_,_ in refs.read_reflog(ref) if objects.object_exists(new))
+        reachable = set()
+        for entry in load_index().values():
+            if entry.sha1 != indexfile.NULL_SHA1 and objects.object_exists(entry.sha1):
+                reachable.add(entry.sha1)
+        visited_trees = set()
+        visited_commits = set()
+        pending = list(roots)
+        while pending:
+            sha1 = pending.pop()
+            if sha1 in visited_commits:
+                continue
+            if not objects.object_exists(sha1):
+                raise Exception(f"Reachable object {sha1} is missing; run fsck before gc")
+            visited_commits.add(sha1)
+            try:
+                commit_object = objects.read_commit(sha1)
+            except Exception as ex:
+                raise Exception(f"Reachable commit {sha1} is unreadable ({ex}); run fsck before gc")
+            if isinstance(commit_object.tree,dict):
+                reachable.update(commit_object.tree.values())
+            else:
+                tree_blobs(commit_object.tree,visited_trees,reachable)
+            pending.extend(commit_object.parents)
+        return reachable | visited_trees | visited_commits
+    except Exception as ex:
+        raise ex
+
+def gc(grace_period=GC_GRACE_PERIOD,dry_run=False):
+    try:
+        if not dry_run:
+            print(f"Packed {refs.pack_refs()} refs")
+        reachable = reachable_objects()
+        cutoff = time.time()-grace_period
+        pruned = recent = freed = 0
+        for sha1 in list(loose_objects()):
+            if sha1 in reachable:
+                continue
+            path = objects.object_path(sha1)
+            stat = os.stat(path)
+            if stat.st_mtime > cutoff:
+                recent += 1
+                continue
+            pruned += 1
+            freed += stat.st_size
+            if not dry_run:
+                os.remove(path)
+        objects_dir = repo_path("objects")
+        for fanout in os.listdir(objects_dir):
+            directory = os.path.join(objects_dir,fanout)
+            if len(fanout) != 2 or not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                # Leftovers of interrupted writes.
+                if name.startswith("tmp_obj_") and os.stat(os.path.join(directory,name)).st_mtime <= cutoff and not dry_run:
+                    os.remove(os.path.join(directory,name))
+            if not os.listdir(directory) and not dry_run:
+                os.rmdir(directory)
+        print(f"{'Would prune' if dry_run else 'Pruned'} {pruned} unreachable loose objects ({freed/1024:.1f} KB), "
+              f"kept {recent} unreachable objects younger than the grace period and {len(reachable)} reachable objects")
+    except Exception as ex:
+        raise ex
+
+def fsck_object(sha1):
+    """Verify one object in a worker; returns (sha1, kind, problem, [(referenced id, expected kind)])."""
+    try:
+        import hashlib
+        digest = hashlib.sha1()
+        chunks = []
+        for chunk in objects.read_object_chunks(sha1):
+            digest.update(chunk)
+            if chunks or chunk[:1] == b"{":
+                chunks.append(chunk)
+        if digest.hexdigest() != sha1:
+            return sha1,None,f"hash mismatch, content hashes to {digest.hexdigest()}",[]
+        content = b"".join(chunks)
+        kind = objects.object_type(content) if content else "blob"
+        references = []
+        if kind == "tree":
+            references = [(entry_sha1,entry_kind) for entry_kind,entry_sha1 in objects.Tree.decode(sha1,content).entries.values()]
+        elif kind == "commit":
+            commit_object = objects.Commit.decode(sha1,content)
+            if isinstance(commit_object.tree,dict):
+                references = [(blob,"blob") for blob in commit_object.tree.values()]
+            else:
+                references = [(commit_object.tree,"tree")]
+            references.extend((parent,"commit") for parent in commit_object.parents)
+        return sha1,kind,None,references
+    except Exception as ex:
+        return sha1,None,f"unreadable ({ex})",[]
+
+def fsck(jobs=None):
+    try:
+        names = dict.fromkeys(loose_objects())
+        for object_pack in objects.packs():
+            names.update(dict.fromkeys(object_pack.index.names()))
+        names = list(names)
+        total = len(names)
+        kinds = {}
+        problems = {}
+        references = {}
+        jobs = jobs or os.cpu_count() or 1
+        step = max(1,total//100)
+        show_progress = sys.stderr.isatty()
+        executor = None
+        if jobs > 1 and total >= PARALLEL_HASH_THRESHOLD:
+            from concurrent.futures import ProcessPoolExecutor
+            executor = ProcessPoolExecutor(max_workers=jobs)
+            results = executor.map(fsck_object,names,chunksize=max(1,total//(jobs*16)))
+        else:
+            results = map(fsck_object,names)
+        try:
+            for done,(sha1,kind,problem,object_references) in enumerate(results,1):
+                if problem:
+                    problems[sha1] = problem
+                else:
+                    kinds[sha1] = kind
+                    references[sha1] = object_references
+                if show_progress and (done % step == 0 or done == total):
+                    sys.stderr.write(f"\rChecking objects: {done*100//total}% ({done}/{total})")
+                    sys.stderr.flush()
+        finally:
+            if executor:
+                executor.shutdown()
+        if show_progress and total:
+            sys.stderr.write("\n")
+        # Objects carry no type header, so a blob that happens to look like a tree or commit is only
+        # treated as one when nothing refers to it as a blob.
+        blobs = {ref for object_references in references.values() for ref,expected in object_references if expected == "blob"}
+        missing = {}
+        for sha1,object_references in references.items():
+            if sha1 in blobs:
+                continue
+            for ref,expected in object_references:
+                if ref in problems:
+                    continue
+                if ref not in kinds:
+                    missing.setdefault(ref,[]).append(sha1)
+                elif expected != "blob" and kinds[ref] != expected:
+                    problems[sha1] = f"refers to {ref} as a {expected} but it is a {kinds[ref]}"
+        roots = [(tip,"ref") for tip in ref_tips()]
+        roots.extend((entry.sha1,f"index entry {filename}") for filename,entry in load_index().items()
+                     if entry.staged and entry.sha1 != indexfile.NULL_SHA1)
+        for sha1,referrer in roots:
+            if sha1 not in kinds and sha1 not in problems:
+                missing.setdefault(sha1,[]).append(referrer)
+        counts = {}
+        for kind in kinds.values():
+            counts[kind] = counts.get(kind,0)+1
+        for sha1,problem in sorted(problems.items()):
+            print(f"corrupt {sha1}: {problem}")
+        for sha1,referrers in sorted(missing.items()):
+            print(f"missing {sha1} (referenced by {referrers[0]}{f' and {len(referrers)-1} more' if len(referrers) > 1 else ''})")
+        breakdown = ", ".join(f"{counts[kind]} {kind}s" for kind in sorted(counts))
+        print(f"Checked {total} objects ({breakdown or 'none'}) : {len(problems)} corrupt, {len(missing)} missing")
+        if problems or missing:
+            raise Exception(f"fsck found {len(problems)} corrupt and {len(missing)} missing objects")
     except Exception as ex:
-        raise ex
\ No newline at end of file
+        raise ex
+
+def rev_parse(name):
+    """Resolve HEAD, a branch, a full id or a unique abbreviated id to an object id."""
+    try:
+        name = name.strip()
+        if name == "HEAD":
+            commit_hash = get_head()
+        else:
+            commit_hash = refs.read_branch(name)
+        if commit_hash is None and MIN_ABBREV <= len(name) < 40 and all(char in "0123456789abcdefABCDEF" for char in name):
+            matches = objects.abbreviated_matches(name)
+            if len(matches) > 1:
+                raise Exception(f"Short object id {name} is ambiguous")
+            commit_hash = matches[0] if matches else None
+        elif commit_hash is None:
+            commit_hash = name.lower()
+        if not commit_hash or not objects.object_exists(commit_hash):
+            raise Exception(f"Unknown revision : {name}")
+        return commit_hash
+    except Exception as ex:
+        raise ex
+
+def diff_pairs(commits,cached):
+    try:
+        if len(commits) == 2:
+            trees = [commit_tree(objects.read_commit(rev_parse(name))) for name in commits]
+            return [(path,old,new,None) for path,old,new in diff_trees(*trees)]
+        tracked_files = head_files()
+        index_content = load_index()
+        staged = staged_entries(index_content)
+        pairs = []
+        if cached:
+            for path,sha1 in sorted(staged.items()):
+                if tracked_files.get(path) != sha1:
+                    pairs.append((path,tracked_files.get(path),sha1,None))
+            return pairs
+        tracked = dict(tracked_files)
+        tracked.update(staged)
+        cached_entries = dict(index_content)
+        for path,sha1 in sorted(tracked.items()):
+            if sha1 is None:
+                continue
+            if not path_is_file(path):
+                pairs.append((path,sha1,None,None))
+            elif hash_path(path,index_content,write=False) != sha1:
+                pairs.append((path,sha1,index_content[path].sha1,path))
+        if index_content != cached_entries:
+            save_index(index_content)
+        return pairs
+    except Exception as ex:
+        raise ex
+
+def diff_content(sha1,path):
+    if path:
+        with open(path,"rb") as file:
+            return file.read()
+    return objects.read_blob(sha1).data if sha1 else b""
+
+def diff(commits=None,cached=False,stat=False):
+    try:
+        import diff as line_diff
+        commits = commits or []
+        if len(commits) not in (0,2):
+            raise Exception("diff takes either no commits or two commits")
+        out = sys.stdout.buffer
+        total_files = total_insertions = total_deletions = 0
+        for path,old_sha1,new_sha1,work_path in diff_pairs(commits,cached):
+            old_content = diff_content(old_sha1,None)
+            new_content = diff_content(new_sha1,work_path)
+            binary = line_diff.is_binary(old_content) or line_diff.is_binary(new_content)
+            old_lines = old_content.splitlines(True)
+            new_lines = new_content.splitlines(True)
+            total_files += 1
+            if stat:
+                if binary:
+                    out.write(f" {path} | Bin {len(old_content)} -> {len(new_content)} bytes\n".encode())
+                    continue
+                insertions,deletions = line_diff.diff_stat(old_lines,new_lines)
+                total_insertions += insertions
+                total_deletions += deletions
+                out.write(f" {path} | {insertions+deletions} {'+'*min(insertions,40)}{'-'*min(deletions,40)}\n".encode())
+                continue
+            out.write(f"diff --microgit a/{path} b/{path}\n".encode())
+            if binary:
+                out.write(f"Binary files a/{path} and b/{path} differ\n".encode())
+                continue
+            out.write((f"--- a/{path}\n" if old_sha1 else "--- /dev/null\n").encode())
+            out.write((f"+++ b/{path}\n" if new_sha1 else "+++ /dev/null\n").encode())
+            for line in line_diff.unified_diff(old_lines,new_lines):
+                out.write(line)
+        if stat and total_files:
+            out.write(f" {total_files} files changed, {total_insertions} insertions(+), {total_deletions} deletions(-)\n".encode())
+        out.flush()
+    except Exception as ex:
+        raise ex
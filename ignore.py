@@ -0,0 +1,217 @@
+import os
+import re
+import stat
+
+IGNORE_FILE = ".microgitignore"
+GIT_DIR = ".microgit"
+
+def translate(pattern):
+    """Translate one gitignore-style glob into a regex over '/'-separated relative paths."""
+    parts = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "*" and pattern.startswith("**",i) and (i == 0 or pattern[i-1] == "/"):
+            rest = pattern[i+2:]
+            if not rest:
+                parts.append(".*")
+                i += 2
+                continue
+            if rest.startswith("/"):
+                parts.append("(?:.*/)?")
+                i += 3
+                continue
+        if char == "*":
+            while pattern.startswith("*",i+1):
+                i += 1
+            parts.append("[^/]*")
+        elif char == "?":
+            parts.append("[^/]")
+        elif char == "[":
+            # A ']' right after '[' or '[!' is a literal member of the class, not its end.
+            start = i+2 if pattern[i+1:i+2] in ("!","^") else i+1
+            end = pattern.find("]",start+1)
+            expression = None
+            if end != -1:
+                body = pattern[i+1:end]
+                if body[:1] in ("!","^"):
+                    body = "^"+body[1:]
+                expression = "(?!/)["+body.replace("\\","\\\\").replace("[","\\[")+"]"
+                try:
+                    re.compile(expression)
+                except re.error:
+                    expression = None
+            if expression is None:
+                parts.append(re.escape(char))
+            else:
+                parts.append(expression)
+                i = end
+        elif char == "\\" and i+1 < len(pattern):
+            i += 1
+            parts.append(re.escape(pattern[i]))
+        else:
+            parts.append(re.escape(char))
+        i += 1
+    return "".join(parts)
+
+class IgnoreRules:
+    """All patterns of one ignore file compiled into a single regex per entry kind; the last matching pattern wins."""
+    def __init__(self,lines):
+        patterns = []
+        for line in lines:
+            line = line.rstrip("\r\n")
+            if not line.endswith("\\ "):
+                line = line.rstrip(" ")
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            anchored = "/" in line
+            regex = translate(line.lstrip("/"))
+            patterns.append(((regex if anchored else "(?:.*/)?"+regex),negate,dir_only))
+        self.count = len(patterns)
+        self.file_matcher = self.compile([pattern for pattern in patterns if not pattern[2]])
+        self.dir_matcher = self.compile(patterns)
+
+    @staticmethod
+    def compile(patterns):
+        if not patterns:
+            return None
+        patterns = patterns[::-1]
+        return re.compile("|".join(f"({regex})" for regex,_,_ in patterns),re.DOTALL),[negate for _,negate,_ in patterns]
+
+    def match(self,path,is_dir=False):
+        """Return True (ignored), False (re-included by a negation) or None when no pattern matches."""
+        matcher = self.dir_matcher if is_dir else self.file_matcher
+        if matcher is None:
+            return None
+        regex,negations = matcher
+        match = regex.fullmatch(path)
+        if match is None:
+            return None
+        return not negations[match.lastindex-1]
+
+NO_RULES = IgnoreRules([])
+
+class Directory:
+    __slots__ = ("signature","ignore_signature","entries","rules")
+
+    def __init__(self,signature,ignore_signature,entries,rules):
+        self.signature = signature
+        self.ignore_signature = ignore_signature
+        self.entries = entries
+        self.rules = rules
+
+class Worktree:
+    """Recursive, ignore-aware walk of the working tree, cached per directory mtime."""
+    def __init__(self,root_ignore_file,stat_function=os.stat):
+        self.root_ignore_file = root_ignore_file
+        self.stat = stat_function
+        self.directories = {}
+        self.validated = set()
+
+    def refresh(self):
+        """Start a new pass: every cached directory is re-checked against its mtime the next time it is used."""
+        self.validated.clear()
+
+    def signature(self,path):
+        try:
+            result = self.stat(path)
+            return result.st_mtime_ns,result.st_size,result.st_ino
+        except FileNotFoundError:
+            return None
+
+    def read_rules(self,directory):
+        lines = []
+        paths = [self.root_ignore_file] if directory == "." else []
+        paths.append(os.path.join(directory,IGNORE_FILE))
+        for path in paths:
+            if os.path.isfile(path):
+                with open(path,"r") as file:
+                    lines.extend(file.readlines())
+        return IgnoreRules(lines) if lines else NO_RULES
+
+    def ignore_signature(self,directory):
+        signature = self.signature(os.path.join(directory,IGNORE_FILE))
+        if directory == ".":
+            return signature,self.signature(self.root_ignore_file)
+        return signature
+
+    def directory(self,directory):
+        cached = self.directories.get(directory)
+        if cached and directory in self.validated:
+            return cached
+        self.validated.add(directory)
+        signature = self.signature(directory)
+        ignore_signature = self.ignore_signature(directory)
+        if cached and cached.signature == signature and signature is not None:
+            if cached.ignore_signature != ignore_signature:
+                cached.rules = self.read_rules(directory)
+                cached.ignore_signature = ignore_signature
+            return cached
+        entries = []
+        if signature is not None:
+            with os.scandir(directory) as scanner:
+                for entry in scanner:
+                    if entry.is_symlink() and entry.is_dir():
+                        continue
+                    entries.append((entry.name,entry.is_dir()))
+            entries.sort()
+        cached = Directory(signature,ignore_signature,entries,self.read_rules(directory))
+        self.directories[directory] = cached
+        return cached
+
+    def ignored_here(self,path,is_dir):
+        # Deeper ignore files take precedence over the ones above them.
+        directory = os.path.dirname(path) or "."
+        while True:
+            base = "" if directory == "." else directory+os.sep
+            relative = path[len(base):].replace(os.sep,"/")
+            result = self.directory(directory).rules.match(relative,is_dir)
+            if result is not None:
+                return result
+            if directory == ".":
+                return False
+            directory = os.path.dirname(directory) or "."
+
+    def is_ignored(self,path,is_dir=None):
+        path = os.path.normpath(path)
+        if path == ".":
+            return False
+        parts = path.split(os.sep)
+        if GIT_DIR in parts:
+            return True
+        for depth in range(1,len(parts)):
+            if self.ignored_here(os.sep.join(parts[:depth]),True):
+                return True
+        if is_dir is None:
+            try:
+                is_dir = stat.S_ISDIR(self.stat(path).st_mode)
+            except FileNotFoundError:
+                is_dir = False
+        return self.ignored_here(path,is_dir)
+
+    def walk(self,top="."):
+        """Return the sorted non-ignored files below top, pruning ignored directories without listing them."""
+        top = os.path.normpath(top)
+        files = []
+        if not self.is_ignored(top,True):
+            self.walk_directory(top,files)
+        return sorted(files)
+
+    def walk_directory(self,directory,files):
+        for name,is_dir in self.directory(directory).entries:
+            if is_dir and name == GIT_DIR:
+                continue
+            path = name if directory == "." else os.path.join(directory,name)
+            if self.ignored_here(path,is_dir):
+                continue
+            if is_dir:
+                self.walk_directory(path,files)
+            else:
+                files.append(path)
@@ -0,0 +1,70 @@
+import os
+import time
+import struct
+from collections import namedtuple
+
+INDEX_SIGNATURE = b"MIDX"
+INDEX_VERSION = 1
+HEADER = struct.Struct(">4sIIq")
+ENTRY = struct.Struct(">20sqqQQBH")
+FLAG_STAGED = 1
+NULL_SHA1 = "0"*40
+
+IndexEntry = namedtuple("IndexEntry",["sha1","mtime_ns","ctime_ns","size","inode","staged"])
+
+def entry_from_stat(sha1,stat,staged=False):
+    return IndexEntry(sha1,stat.st_mtime_ns,stat.st_ctime_ns,stat.st_size,stat.st_ino,staged)
+
+def stat_matches(entry,stat):
+    return (entry.mtime_ns == stat.st_mtime_ns and entry.ctime_ns == stat.st_ctime_ns
+            and entry.size == stat.st_size and entry.inode == stat.st_ino)
+
+def read_index(path):
+    entries = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path,"rb") as file:
+        data = file.read()
+    if not data.strip():
+        return entries
+    if data[:1] == b"{":
+        import json
+        for filename,sha1 in json.loads(data.decode()).items():
+            entries[filename] = IndexEntry(sha1,0,0,0,0,True)
+        return entries
+    signature,version,count,_ = HEADER.unpack_from(data,0)
+    if signature != INDEX_SIGNATURE or version != INDEX_VERSION:
+        raise Exception(f"Unsupported index file : {path}")
+    pos = HEADER.size
+    for _ in range(count):
+        sha1,mtime_ns,ctime_ns,size,inode,flags,path_length = ENTRY.unpack_from(data,pos)
+        pos += ENTRY.size
+        filename = data[pos:pos+path_length].decode()
+        pos += path_length
+        entries[filename] = IndexEntry(sha1.hex(),mtime_ns,ctime_ns,size,inode,bool(flags & FLAG_STAGED))
+    return entries
+
+def write_index(path,entries):
+    written_ns = time.time_ns()
+    racy_second = written_ns // 1_000_000_000
+    chunks = [HEADER.pack(INDEX_SIGNATURE,INDEX_VERSION,len(entries),written_ns)]
+    for filename in sorted(entries):
+        entry = entries[filename]
+        if entry.mtime_ns // 1_000_000_000 >= racy_second:
+            # Modified in the same second the index is written: the stat data
+            # cannot prove the file is unchanged later, so force a rehash.
+            entry = entry._replace(mtime_ns=0,ctime_ns=0,size=0,inode=0)
+        encoded = filename.encode()
+        chunks.append(ENTRY.pack(bytes.fromhex(entry.sha1),entry.mtime_ns,entry.ctime_ns,entry.size,
+                                 entry.inode,FLAG_STAGED if entry.staged else 0,len(encoded)))
+        chunks.append(encoded)
+    import tempfile
+    fd,tmp_path = tempfile.mkstemp(prefix="tmp_index_",dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd,"wb") as file:
+            file.write(b"".join(chunks))
+        os.replace(tmp_path,path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -1,83 +1,188 @@
+import os
+import sys
 import argparse
 import helpers
+import refs
+import tracing
+
+PROFILE_LINES = 40
 
 
 parser = argparse.ArgumentParser(description="A Simple microgit command line tool")
+parser.add_argument("--trace",metavar="FILE",help="Record timing spans and counters as a Chrome trace JSON file")
+parser.add_argument("--profile",help="Run under cProfile and print sorted stats to stderr",action="store_true")
+parser.add_argument("--profile-output",metavar="FILE",help="Also dump the raw cProfile stats to FILE")
 sub_parser = parser.add_subparsers(dest="git_command")
 
 init_command = sub_parser.add_parser("init",help="Initialize a git repository")
-init_command.set_defaults(func=helpers.init)
+init_command.set_defaults(func=lambda arguments:helpers.init())
 
 hash_object = sub_parser.add_parser("hash-object",help="Hash given file")
-hash_object.add_argument("file")
-hash_object.set_defaults(func=helpers.hash_object)
+hash_object.add_argument("file",nargs="?")
+hash_object.add_argument("--stdin-paths",help="Read file paths from stdin, one per line, and print one id per path",action="store_true")
+hash_object.set_defaults(func=lambda arguments:hash_object_command(arguments))
 
 cat_file = sub_parser.add_parser("cat-file",help="Return contents of file hash")
-cat_file.add_argument("hash")
-cat_file.set_defaults(func=helpers.cat_file)
+cat_file.add_argument("hash",nargs="?")
+cat_file.add_argument("--output","-o",help="Stream the object contents to a file instead of printing them")
+cat_file.add_argument("--batch",help="Read ids from stdin and print '<id> <type> <size>' followed by the raw contents",action="store_true")
+cat_file.add_argument("--batch-check",help="Like --batch but only print the '<id> <type> <size>' header",action="store_true")
+cat_file.set_defaults(func=lambda arguments:cat_file_command(arguments))
 
 add_file = sub_parser.add_parser("add",help="To add file to the git repository")
-add_file.add_argument("filename",nargs="+")
-add_file.set_defaults(func=helpers.add)
+add_file.add_argument("filename",nargs="+",help="Files or directories to add ('.' adds the whole tree)")
+add_file.add_argument("--jobs","-j",type=int,help="Number of hashing processes (defaults to the CPU count)")
+add_file.set_defaults(func=lambda arguments:helpers.add(arguments.filename,jobs=arguments.jobs))
 
 commit_file = sub_parser.add_parser("commit",help="Commit files added using 'add' command")
 commit_file.add_argument("--message","-m",required=True,type=str)
-commit_file.set_defaults(func=helpers.commit)
+commit_file.set_defaults(func=lambda arguments:helpers.commit(arguments.message))
 
 log_files = sub_parser.add_parser("log",help="To get commit logs")
 log_files.add_argument("--all-parents",help="To get all parents commit info",action="store_true")
 log_files.add_argument("--oneline",help="Display commit in oneline",action="store_true")
-log_files.set_defaults(func=helpers.log)
+log_files.add_argument("--max-count","-n",type=int,help="Stop after this many commits")
+log_files.add_argument("--since",help="Only commits newer than a date, a unix timestamp or '<n> <unit>s ago'")
+log_files.add_argument("--until",help="Only commits older than a date, a unix timestamp or '<n> <unit>s ago'")
+log_files.add_argument("revision",nargs="?",default="HEAD",help="Branch, full or abbreviated commit id to start from")
+log_files.add_argument("paths",nargs="*",help="After '--', only show commits that changed these files or directories")
+log_files.set_defaults(func=lambda arguments:helpers.log(all_parents=arguments.all_parents,one_line=arguments.oneline,revision=arguments.revision,
+                                                        max_count=arguments.max_count,since=arguments.since,until=arguments.until,paths=arguments.paths))
 
 checkout_command = sub_parser.add_parser("checkout",help="Checkout to a particular commit hash or to a tag name or to another branch")
-checkout_command.add_argument("commithash",help="Commit hash/branch/tagname")
-checkout_command.set_defaults(func=helpers.checkout)
+checkout_command.add_argument("commithash",help="Branch name, full or abbreviated commit id")
+checkout_command.set_defaults(func=lambda arguments:helpers.checkout(arguments.commithash))
 
 branch_command = sub_parser.add_parser("branch",help="Create or list branches")
 branch_command.add_argument("branchname",nargs="?",help="Name of branch")
-branch_command.set_defaults(func=helpers.branch)
+branch_command.set_defaults(func=lambda arguments:helpers.branch(arguments.branchname))
 
 status_command = sub_parser.add_parser("status",help="Status of the repository")
-status_command.set_defaults(func=helpers.status)
+status_command.set_defaults(func=lambda arguments:helpers.status())
 
 merge_command = sub_parser.add_parser("merge",help="Merge a branch to another branch in repository")
-merge_command.add_argument("branchname",help="branch name")
-merge_command.set_defaults(func=helpers.merge)
+merge_command.add_argument("branchname",help="Branch name, full or abbreviated commit id")
+merge_command.set_defaults(func=lambda arguments:helpers.merge(arguments.branchname))
 
 reset_command = sub_parser.add_parser("reset",help="Remove file from the staging area")
 reset_command.add_argument("filename",nargs="+",help="Files to remove from staging")
-reset_command.set_defaults(func=helpers.reset)
+reset_command.set_defaults(func=lambda arguments:helpers.reset(arguments.filename))
 
-if __name__ == "__main__":
+repack_command = sub_parser.add_parser("repack",help="Pack loose objects into a single delta-compressed packfile")
+repack_command.set_defaults(func=lambda arguments:helpers.repack())
+
+diff_command = sub_parser.add_parser("diff",help="Show changes between the working tree, the index and commits")
+diff_command.add_argument("commits",nargs="*",help="Two commits or branches to compare")
+diff_command.add_argument("--cached",help="Compare staged changes against HEAD",action="store_true")
+diff_command.add_argument("--stat",help="Only show per-file change counts",action="store_true")
+diff_command.set_defaults(func=lambda arguments:helpers.diff(arguments.commits,cached=arguments.cached,stat=arguments.stat))
+
+rev_parse_command = sub_parser.add_parser("rev-parse",help="Print the full object id of HEAD, a branch or an abbreviated id")
+rev_parse_command.add_argument("name")
+rev_parse_command.set_defaults(func=lambda arguments:print(helpers.rev_parse(arguments.name)))
+
+pack_refs_command = sub_parser.add_parser("pack-refs",help="Move loose branch refs into the packed-refs file")
+pack_refs_command.set_defaults(func=lambda arguments:print(f"Packed {refs.pack_refs()} refs"))
+
+reflog_command = sub_parser.add_parser("reflog",help="Show the history of HEAD or a branch")
+reflog_command.add_argument("ref",nargs="?",default="HEAD",help="HEAD or a branch name")
+reflog_command.set_defaults(func=lambda arguments:helpers.reflog(arguments.ref))
+
+gc_command = sub_parser.add_parser("gc",help="Prune loose objects that are unreachable from refs, HEAD, MERGE_HEAD and the index")
+gc_command.add_argument("--prune",metavar="SECONDS",type=int,default=helpers.GC_GRACE_PERIOD,help="Only prune objects older than this (default two weeks)")
+gc_command.add_argument("--dry-run",help="Report what would be pruned without deleting anything",action="store_true")
+gc_command.set_defaults(func=lambda arguments:helpers.gc(grace_period=arguments.prune,dry_run=arguments.dry_run))
+
+fsck_command = sub_parser.add_parser("fsck",help="Verify object hashes and commit/tree connectivity")
+fsck_command.add_argument("--jobs","-j",type=int,help="Number of verifying processes (defaults to the CPU count)")
+fsck_command.set_defaults(func=lambda arguments:helpers.fsck(jobs=arguments.jobs))
+
+daemon_command = sub_parser.add_parser("daemon",help="Watch the working tree and serve status/add/diff from a warm process")
+daemon_command.add_argument("--poll",help="Re-stat the tree on every request instead of using inotify",action="store_true")
+daemon_command.add_argument("--stop",help="Stop the running daemon",action="store_true")
+daemon_command.set_defaults(func=lambda arguments:daemon_command_run(arguments))
+
+def daemon_command_run(arguments):
+    import daemon
+    if arguments.stop:
+        daemon.stop()
+    else:
+        daemon.serve(lambda argv:run_command(parse_arguments(argv)),poll=arguments.poll)
+
+def hash_object_command(arguments):
+    if arguments.stdin_paths:
+        if arguments.file:
+            raise Exception("hash-object --stdin-paths does not take a file argument")
+        helpers.hash_object_paths(sys.stdin,sys.stdout.buffer)
+    elif arguments.file:
+        print(helpers.hash_object(arguments.file))
+    else:
+        raise Exception("hash-object needs a file or --stdin-paths")
+
+def cat_file_command(arguments):
+    if arguments.batch or arguments.batch_check:
+        if arguments.hash or arguments.output:
+            raise Exception("cat-file --batch reads ids from stdin and takes no other arguments")
+        helpers.cat_file_batch(sys.stdin,sys.stdout.buffer,contents=arguments.batch)
+    elif not arguments.hash:
+        raise Exception("cat-file needs an object id, --batch or --batch-check")
+    elif arguments.output:
+        helpers.cat_file(arguments.hash,output=arguments.output)
+    else:
+        print(helpers.cat_file(arguments.hash))
+
+def parse_arguments(argv):
+    # argparse hands the first path of "log -- <path>" to the optional revision, so split the paths off before parsing.
+    if "--" in argv and "log" in argv[:argv.index("--")]:
+        separator = argv.index("--")
+        arguments = parser.parse_args(argv[:separator])
+        if arguments.git_command == "log" and not arguments.paths:
+            arguments.paths = argv[separator+1:]
+            return arguments
+    return parser.parse_args(argv)
+
+def run_command(arguments):
+    if not arguments.git_command:
+        parser.print_help()
+        return
+    arguments.func(arguments)
+
+def run_on_daemon(arguments):
+    if arguments.trace or arguments.profile or os.environ.get("MICROGIT_NO_DAEMON"):
+        return False
+    if not os.path.exists(os.path.join(helpers.GIT_DIR,"daemon.sock")):
+        return False
+    import daemon
+    return arguments.git_command in daemon.DAEMON_COMMANDS and daemon.forward(sys.argv[1:])
+
+def run(arguments):
+    if run_on_daemon(arguments):
+        return
+    if arguments.trace:
+        tracing.enable()
     try:
-        arguments = parser.parse_args()
-        if arguments.git_command == "init":
-            arguments.func()
-        elif arguments.git_command == "hash-object":
-            print(arguments.func(arguments.file))
-        elif arguments.git_command == "cat-file":
-            print(arguments.func(arguments.hash))
-        elif arguments.git_command == "add":
-            arguments.func(arguments.filename)
-        elif arguments.git_command == "commit":
-            arguments.func(arguments.message)
-        elif arguments.git_command == "log":
-            if arguments.all_parents:
-                arguments.func(all_parents=arguments.all_parents)
-            elif arguments.oneline:
-                arguments.func(one_line=arguments.oneline)
+        with tracing.span(arguments.git_command or "microgit"):
+            if arguments.profile:
+                import cProfile
+                import pstats
+                profiler = cProfile.Profile()
+                try:
+                    profiler.runcall(run_command,arguments)
+                finally:
+                    stats = pstats.Stats(profiler,stream=sys.stderr)
+                    stats.sort_stats("cumulative").print_stats(PROFILE_LINES)
+                    if arguments.profile_output:
+                        stats.dump_stats(arguments.profile_output)
             else:
-                arguments.func()
-        elif arguments.git_command == "checkout":
-            arguments.func(arguments.commithash)
-        elif arguments.git_command == "branch":
-            arguments.func(arguments.branchname)
-        elif arguments.git_command == "status":
-            arguments.func()
-        elif arguments.git_command == "merge":
-            arguments.func(arguments.branchname)
-        elif arguments.git_command == "reset":
-            arguments.func(arguments.filename)
+                run_command(arguments)
+    finally:
+        if arguments.trace:
+            tracing.write(arguments.trace)
+
+if __name__ == "__main__":
+    try:
+        arguments = parse_arguments(sys.argv[1:])
+        run(arguments)
     except Exception as ex:
         print(f"{str(ex)}")
     
\ No newline at end of file
@@ -0,0 +1,327 @@
+import os
+import json
+import _thread
+from collections import OrderedDict
+import tracing
+
+OBJECTS_DIR = os.path.join(".microgit","objects")
+CHUNK_SIZE = 1024*1024
+CACHE_BYTES = 64*1024*1024
+MAX_CACHED_OBJECT = CACHE_BYTES//8
+# Trees and commits are small JSON documents; anything bigger is typed as a blob without being decoded.
+MAX_TYPE_SNIFF = CHUNK_SIZE
+# Rough per-object overhead of the decoded Python representation on top of its raw bytes.
+OBJECT_OVERHEAD = 256
+
+class Blob:
+    __slots__ = ("sha1","data")
+    kind = "blob"
+
+    def __init__(self,sha1,data):
+        self.sha1 = sha1
+        self.data = data
+
+    @classmethod
+    def decode(cls,sha1,content):
+        return cls(sha1,content)
+
+    @property
+    def size(self):
+        return len(self.data)
+
+class Tree:
+    __slots__ = ("sha1","entries","size")
+    kind = "tree"
+
+    def __init__(self,sha1,entries,size=0):
+        self.sha1 = sha1
+        self.entries = entries
+        self.size = size
+
+    @classmethod
+    def decode(cls,sha1,content):
+        entries = {name:(kind,entry_sha1) for kind,entry_sha1,name in json.loads(content.decode("utf-8"))['entries']}
+        return cls(sha1,entries,len(content))
+
+    def encode(self):
+        content = {"type":"tree","entries":[[self.entries[name][0],self.entries[name][1],name] for name in sorted(self.entries)]}
+        return json.dumps(content).encode("utf-8")
+
+class Commit:
+    __slots__ = ("sha1","tree","parent","merged_parent","username","email","date","message","size")
+    kind = "commit"
+
+    def __init__(self,sha1,content,size=0):
+        self.sha1 = sha1
+        self.tree = content['tree']
+        self.parent = content.get('parent')
+        self.merged_parent = content.get('merged_parent')
+        self.username = content.get('username')
+        self.email = content.get('email')
+        self.date = content['date']
+        self.message = content['message']
+        self.size = size
+
+    @classmethod
+    def decode(cls,sha1,content):
+        return cls(sha1,json.loads(content.decode("utf-8")),len(content))
+
+    @property
+    def parents(self):
+        return [parent for parent in (self.parent,self.merged_parent) if parent]
+
+class ObjectCache:
+    """LRU of decoded objects keyed by id, evicting least recently used entries past a byte budget."""
+    def __init__(self,max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = _thread.allocate_lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self,sha1,kind):
+        with self.lock:
+            obj = self.entries.get(sha1)
+            if obj is None or not isinstance(obj,kind):
+                return None
+            self.entries.move_to_end(sha1)
+            return obj
+
+    def put(self,obj):
+        cost = obj.size+OBJECT_OVERHEAD
+        if cost > min(self.max_bytes,MAX_CACHED_OBJECT):
+            return
+        with self.lock:
+            previous = self.entries.pop(obj.sha1,None)
+            if previous is not None:
+                self.current_bytes -= previous.size+OBJECT_OVERHEAD
+            self.entries[obj.sha1] = obj
+            self.current_bytes += cost
+            while self.current_bytes > self.max_bytes:
+                _,evicted = self.entries.popitem(last=False)
+                self.current_bytes -= evicted.size+OBJECT_OVERHEAD
+                tracing.count("object_cache_evictions")
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+cache = ObjectCache()
+loaded_packs = None
+
+def object_path(sha1):
+    return os.path.join(OBJECTS_DIR,sha1[:2],sha1[2:])
+
+def packs():
+    global loaded_packs
+    if loaded_packs is None:
+        import pack
+        loaded_packs = pack.load_packs(os.path.join(OBJECTS_DIR,"pack"))
+    return loaded_packs
+
+def reload_packs():
+    global loaded_packs
+    if loaded_packs:
+        for object_pack in loaded_packs:
+            object_pack.close()
+    loaded_packs = None
+
+def clear_caches():
+    reload_packs()
+    cache.clear()
+
+def find_pack(sha1):
+    for object_pack in packs():
+        if sha1 in object_pack:
+            return object_pack
+    return None
+
+def object_exists(sha1):
+    if not sha1 or len(sha1) != 40:
+        return False
+    return find_pack(sha1) is not None or os.path.exists(object_path(sha1))
+
+def abbreviated_matches(prefix,limit=2):
+    """Ids starting with prefix, from the pack indexes and the single loose fan-out directory it selects."""
+    prefix = prefix.lower()
+    matches = set()
+    for object_pack in packs():
+        for sha1 in object_pack.index.matches(prefix):
+            matches.add(sha1)
+            if len(matches) >= limit:
+                break
+    directory = os.path.join(OBJECTS_DIR,prefix[:2])
+    if os.path.isdir(directory):
+        matches.update(prefix[:2]+name for name in os.listdir(directory) if len(name) == 38 and name.startswith(prefix[2:]))
+    return sorted(matches)
+
+def read_chunks(file):
+    return iter(lambda: file.read(CHUNK_SIZE),b"")
+
+def store_object(sha1,chunks):
+    try:
+        if object_exists(sha1):
+            return sha1
+        import zlib
+        import hashlib
+        import tempfile
+        directory = os.path.dirname(object_path(sha1))
+        os.makedirs(directory,exist_ok=True)
+        fd,tmp_path = tempfile.mkstemp(prefix="tmp_obj_",dir=directory)
+        try:
+            compressor = zlib.compressobj()
+            verify = hashlib.sha1()
+            tracing.count("objects_written")
+            with os.fdopen(fd,"wb") as file:
+                for chunk in chunks:
+                    tracing.count("bytes_compressed",len(chunk))
+                    verify.update(chunk)
+                    file.write(compressor.compress(chunk))
+                file.write(compressor.flush())
+            if verify.hexdigest() != sha1:
+                raise Exception(f"Content changed while writing object {sha1}")
+            os.replace(tmp_path,object_path(sha1))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return sha1
+    except Exception as ex:
+        raise ex
+
+def write_object(content):
+    try:
+        import hashlib
+        tracing.count("hashes_computed")
+        sha1 = hashlib.sha1(content).hexdigest()
+        return store_object(sha1,[content])
+    except Exception as ex:
+        raise ex
+
+def read_object_chunks(sha1):
+    tracing.count("objects_read")
+    if not tracing.enabled:
+        return open_object_chunks(sha1)
+    return traced_chunks(open_object_chunks(sha1))
+
+def traced_chunks(chunks):
+    for chunk in chunks:
+        tracing.count("bytes_decompressed",len(chunk))
+        yield chunk
+
+def open_object_chunks(sha1):
+    object_pack = find_pack(sha1)
+    if object_pack:
+        yield from object_pack.read_chunks(sha1)
+        return
+    object_file = object_path(sha1)
+    if not os.path.exists(object_file):
+        reload_packs()
+        object_pack = find_pack(sha1)
+        if object_pack:
+            yield from object_pack.read_chunks(sha1)
+            return
+        raise Exception(f"Object not found : {sha1}")
+    import zlib
+    decompressor = zlib.decompressobj()
+    with open(object_file,"rb") as file:
+        for chunk in read_chunks(file):
+            data = decompressor.decompress(chunk,CHUNK_SIZE)
+            while data:
+                yield data
+                data = decompressor.decompress(decompressor.unconsumed_tail,CHUNK_SIZE)
+    data = decompressor.flush()
+    if data:
+        yield data
+
+def object_size(sha1):
+    """Uncompressed size of an object, counted while inflating loose objects rather than loading them."""
+    try:
+        object_pack = find_pack(sha1)
+        if object_pack:
+            return object_pack.object_size(sha1)
+        return sum(len(chunk) for chunk in read_object_chunks(sha1))
+    except Exception as ex:
+        raise ex
+
+def read_object(sha1):
+    try:
+        return b"".join(read_object_chunks(sha1))
+    except Exception as ex:
+        raise ex
+
+def object_type(content):
+    # Objects carry no type header: trees and commits are the JSON documents microgit writes, anything else is a blob.
+    if content[:1] != b"{":
+        return "blob"
+    try:
+        decoded = json.loads(content.decode("utf-8"))
+    except ValueError:
+        return "blob"
+    if isinstance(decoded,dict):
+        if decoded.get("type") == "tree" and "entries" in decoded:
+            return "tree"
+        if "tree" in decoded and "message" in decoded and "date" in decoded:
+            return "commit"
+    return "blob"
+
+def object_info(sha1):
+    """Return (type, size, content) reading the object once; content is None for objects past MAX_TYPE_SNIFF, which are blobs."""
+    try:
+        chunks = read_object_chunks(sha1)
+        buffered = []
+        length = 0
+        for chunk in chunks:
+            buffered.append(chunk)
+            length += len(chunk)
+            if length > MAX_TYPE_SNIFF:
+                break
+        else:
+            content = b"".join(buffered)
+            return object_type(content),len(content),content
+        object_pack = find_pack(sha1)
+        if object_pack:
+            chunks.close()
+            return "blob",object_pack.object_size(sha1),None
+        return "blob",length+sum(len(chunk) for chunk in chunks),None
+    except Exception as ex:
+        raise ex
+
+def load(sha1,kind):
+    try:
+        obj = cache.get(sha1,kind)
+        if obj is not None:
+            tracing.count("object_cache_hits")
+            return obj
+        tracing.count("object_cache_misses")
+        with tracing.span(f"decode.{kind.kind}"):
+            obj = kind.decode(sha1,read_object(sha1))
+        cache.put(obj)
+        return obj
+    except Exception as ex:
+        raise ex
+
+def read_blob(sha1):
+    return load(sha1,Blob)
+
+def read_tree(sha1):
+    if not sha1:
+        return Tree(None,{})
+    return load(sha1,Tree)
+
+def read_commit(sha1):
+    return load(sha1,Commit)
+
+def write_tree(entries):
+    try:
+        tree = Tree(None,dict(entries))
+        content = tree.encode()
+        tree.sha1 = write_object(content)
+        tree.size = len(content)
+        cache.put(tree)
+        return tree.sha1
+    except Exception as ex:
+        raise ex
@@ -0,0 +1,336 @@
+import os
+import mmap
+import zlib
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+
+PACK_SIGNATURE = b"MPCK"
+INDEX_SIGNATURE = b"MPIX"
+PACK_VERSION = 1
+OBJ_FULL = 1
+OBJ_DELTA = 2
+FULL_HEADER = struct.Struct(">BQ")
+DELTA_HEADER = struct.Struct(">BQQ")
+CHUNK_SIZE = 1024*1024
+DELTA_WINDOW = 10
+MAX_DELTA_DEPTH = 10
+MAX_DELTA_SIZE = 4*1024*1024
+MIN_COPY_SIZE = 8
+MIN_SIMILARITY = 0.5
+BASE_CACHE_SIZE = 16
+
+def encode_varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def decode_varint(data,pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value,pos
+        shift += 7
+
+def create_delta(base,target):
+    index = {}
+    offset = 0
+    for line in base.splitlines(True):
+        index.setdefault(line,offset)
+        offset += len(line)
+    delta = bytearray(encode_varint(len(base)) + encode_varint(len(target)))
+    insert = bytearray()
+    copy_start = copy_end = None
+
+    def flush_insert():
+        if insert:
+            delta.append(0)
+            delta.extend(encode_varint(len(insert)))
+            delta.extend(insert)
+            insert.clear()
+
+    def flush_copy():
+        if copy_start is None:
+            return
+        if copy_end - copy_start < MIN_COPY_SIZE:
+            insert.extend(base[copy_start:copy_end])
+            return
+        flush_insert()
+        delta.append(1)
+        delta.extend(encode_varint(copy_start))
+        delta.extend(encode_varint(copy_end - copy_start))
+
+    for line in target.splitlines(True):
+        if copy_end is not None and base.startswith(line,copy_end):
+            copy_end += len(line)
+            continue
+        flush_copy()
+        copy_start = index.get(line)
+        if copy_start is not None:
+            copy_end = copy_start+len(line)
+        else:
+            copy_end = None
+            insert.extend(line)
+    flush_copy()
+    flush_insert()
+    return bytes(delta)
+
+def apply_delta(base,delta):
+    base_size,pos = decode_varint(delta,0)
+    target_size,pos = decode_varint(delta,pos)
+    if base_size != len(base):
+        raise Exception("Delta base size mismatch")
+    out = bytearray()
+    while pos < len(delta):
+        op = delta[pos]
+        pos += 1
+        if op == 0:
+            size,pos = decode_varint(delta,pos)
+            out.extend(delta[pos:pos+size])
+            pos += size
+        elif op == 1:
+            start,pos = decode_varint(delta,pos)
+            size,pos = decode_varint(delta,pos)
+            out.extend(base[start:start+size])
+        else:
+            raise Exception(f"Corrupt delta opcode {op}")
+    if len(out) != target_size:
+        raise Exception("Delta target size mismatch")
+    return bytes(out)
+
+class PackIndex:
+    def __init__(self,path):
+        with open(path,"rb") as file:
+            self.map = mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ)
+        if self.map[:4] != INDEX_SIGNATURE:
+            raise Exception(f"Not a microgit pack index : {path}")
+        self.count = struct.unpack_from(">I",self.map,8)[0]
+        self.fanout_offset = 12
+        self.names_offset = self.fanout_offset + 256*4
+        self.offsets_offset = self.names_offset + 20*self.count
+
+    def fanout(self,byte):
+        if byte < 0:
+            return 0
+        return struct.unpack_from(">I",self.map,self.fanout_offset+byte*4)[0]
+
+    def name(self,position):
+        start = self.names_offset + position*20
+        return self.map[start:start+20]
+
+    def find(self,sha1):
+        key = bytes.fromhex(sha1)
+        low,high = self.fanout(key[0]-1),self.fanout(key[0])
+        while low < high:
+            middle = (low+high)//2
+            name = self.name(middle)
+            if name < key:
+                low = middle+1
+            elif name > key:
+                high = middle
+            else:
+                return struct.unpack_from(">Q",self.map,self.offsets_offset+middle*8)[0]
+        return None
+
+    def matches(self,prefix):
+        """Yield the ids starting with a hex prefix of at least two digits, via the fanout and a lower-bound search."""
+        key = bytes.fromhex(prefix if len(prefix) % 2 == 0 else prefix+"0")
+        low,end = self.fanout(key[0]-1),self.fanout(key[0])
+        high = end
+        while low < high:
+            middle = (low+high)//2
+            if self.name(middle) < key:
+                low = middle+1
+            else:
+                high = middle
+        while low < end:
+            sha1 = self.name(low).hex()
+            if not sha1.startswith(prefix):
+                break
+            yield sha1
+            low += 1
+
+    def names(self):
+        for position in range(self.count):
+            yield self.name(position).hex()
+
+    def close(self):
+        self.map.close()
+
+class Pack:
+    def __init__(self,pack_path):
+        self.pack_path = pack_path
+        self.index = PackIndex(pack_path[:-len(".pack")]+".idx")
+        with open(pack_path,"rb") as file:
+            self.map = mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ)
+        if self.map[:4] != PACK_SIGNATURE:
+            raise Exception(f"Not a microgit pack : {pack_path}")
+        self.base_cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+
+    def __contains__(self,sha1):
+        return self.index.find(sha1) is not None
+
+    def entry(self,offset):
+        kind = self.map[offset]
+        if kind == OBJ_FULL:
+            _,size = FULL_HEADER.unpack_from(self.map,offset)
+            return kind,size,None,offset+FULL_HEADER.size
+        if kind == OBJ_DELTA:
+            _,size,base_offset = DELTA_HEADER.unpack_from(self.map,offset)
+            return kind,size,base_offset,offset+DELTA_HEADER.size
+        raise Exception(f"Corrupt pack entry at offset {offset} in {self.pack_path}")
+
+    def inflate_chunks(self,pos):
+        decompressor = zlib.decompressobj()
+        while not decompressor.eof:
+            chunk = self.map[pos:pos+CHUNK_SIZE]
+            if not chunk:
+                raise Exception(f"Truncated pack : {self.pack_path}")
+            pos += len(chunk)
+            data = decompressor.decompress(chunk,CHUNK_SIZE)
+            while data:
+                yield data
+                data = decompressor.decompress(decompressor.unconsumed_tail,CHUNK_SIZE)
+
+    def read_at(self,offset):
+        with self.cache_lock:
+            if offset in self.base_cache:
+                self.base_cache.move_to_end(offset)
+                return self.base_cache[offset]
+        kind,size,base_offset,pos = self.entry(offset)
+        content = b"".join(self.inflate_chunks(pos))
+        if kind == OBJ_DELTA:
+            content = apply_delta(self.read_at(base_offset),content)
+        if len(content) != size:
+            raise Exception(f"Corrupt pack entry at offset {offset} in {self.pack_path}")
+        if size <= MAX_DELTA_SIZE:
+            with self.cache_lock:
+                self.base_cache[offset] = content
+                if len(self.base_cache) > BASE_CACHE_SIZE:
+                    self.base_cache.popitem(last=False)
+        return content
+
+    def read_chunks(self,sha1):
+        offset = self.index.find(sha1)
+        if offset is None:
+            raise Exception(f"Object not found in pack : {sha1}")
+        kind,_,_,pos = self.entry(offset)
+        if kind == OBJ_FULL:
+            yield from self.inflate_chunks(pos)
+        else:
+            yield self.read_at(offset)
+
+    def object_size(self,sha1):
+        offset = self.index.find(sha1)
+        return None if offset is None else self.entry(offset)[1]
+
+    def close(self):
+        self.base_cache.clear()
+        self.map.close()
+        self.index.close()
+
+def load_packs(pack_dir):
+    if not os.path.isdir(pack_dir):
+        return []
+    return [Pack(os.path.join(pack_dir,name)) for name in sorted(os.listdir(pack_dir))
+            if name.endswith(".pack") and os.path.exists(os.path.join(pack_dir,name[:-len(".pack")]+".idx"))]
+
+def line_set(content):
+    return set(content.splitlines())
+
+def similarity(lines_a,lines_b):
+    if not lines_a or not lines_b:
+        return 0
+    return len(lines_a & lines_b)/max(len(lines_a),len(lines_b))
+
+def write_index(path,entries):
+    entries = sorted(entries)
+    fanout = [0]*256
+    for name,_ in entries:
+        fanout[name[0]] += 1
+    total = 0
+    with open(path,"wb") as file:
+        file.write(INDEX_SIGNATURE + struct.pack(">II",PACK_VERSION,len(entries)))
+        for count in fanout:
+            total += count
+            file.write(struct.pack(">I",total))
+        for name,_ in entries:
+            file.write(name)
+        for _,offset in entries:
+            file.write(struct.pack(">Q",offset))
+
+def write_pack(pack_dir,objects):
+    """objects is a list of (sha1, size, read_chunks) tuples; returns the pack name and delta count."""
+    import tempfile
+    os.makedirs(pack_dir,exist_ok=True)
+    pack_fd,tmp_pack = tempfile.mkstemp(prefix="tmp_pack_",dir=pack_dir)
+    index_fd,tmp_index = tempfile.mkstemp(prefix="tmp_idx_",dir=pack_dir)
+    os.close(index_fd)
+    try:
+        name,deltas = write_pack_files(pack_fd,tmp_index,objects)
+        os.replace(tmp_pack,os.path.join(pack_dir,name+".pack"))
+        os.replace(tmp_index,os.path.join(pack_dir,name+".idx"))
+        return name,deltas
+    except BaseException:
+        for tmp_path in (tmp_pack,tmp_index):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        raise
+
+def write_pack_files(pack_fd,tmp_index,objects):
+    entries = []
+    window = []
+    deltas = 0
+    with os.fdopen(pack_fd,"wb") as file:
+        file.write(PACK_SIGNATURE + struct.pack(">II",PACK_VERSION,len(objects)))
+        for sha1,object_size,read_chunks in sorted(objects,key=lambda item:item[1],reverse=True):
+            offset = file.tell()
+            entries.append((bytes.fromhex(sha1),offset))
+            compressor = zlib.compressobj()
+            if object_size > MAX_DELTA_SIZE:
+                file.write(FULL_HEADER.pack(OBJ_FULL,0))
+                size = 0
+                for chunk in read_chunks():
+                    size += len(chunk)
+                    file.write(compressor.compress(chunk))
+                file.write(compressor.flush())
+                end = file.tell()
+                file.seek(offset)
+                file.write(FULL_HEADER.pack(OBJ_FULL,size))
+                file.seek(end)
+                continue
+            content = b"".join(read_chunks())
+            lines = line_set(content)
+            best = None
+            for base_offset,base_content,base_lines,depth in window:
+                if depth >= MAX_DELTA_DEPTH or similarity(lines,base_lines) < MIN_SIMILARITY:
+                    continue
+                delta = create_delta(base_content,content)
+                if len(delta) < len(content)//2 and (best is None or len(delta) < len(best[1])):
+                    best = (base_offset,delta,depth+1)
+            if best:
+                file.write(DELTA_HEADER.pack(OBJ_DELTA,len(content),best[0]))
+                file.write(compressor.compress(best[1]) + compressor.flush())
+                depth = best[2]
+                deltas += 1
+            else:
+                file.write(FULL_HEADER.pack(OBJ_FULL,len(content)))
+                file.write(compressor.compress(content) + compressor.flush())
+                depth = 0
+            window.append((offset,content,lines,depth))
+            if len(window) > DELTA_WINDOW:
+                window.pop(0)
+    write_index(tmp_index,entries)
+    return "pack-" + hashlib.sha1(b"".join(sorted(name for name,_ in entries))).hexdigest(),deltas
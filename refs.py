@@ -0,0 +1,175 @@
+import os
+import time
+from bisect import bisect_left
+
+GIT_DIR = ".microgit"
+HEADS_PREFIX = "refs/heads/"
+PACKED_REFS_HEADER = "# pack-refs sorted\n"
+
+def ref_path(*path):
+    return os.path.join(GIT_DIR,*path)
+
+def check_branch_name(name):
+    parts = name.split("/")
+    if not name or name.startswith("-") or name.endswith(".lock") or ".." in name or any(part in ("",".") for part in parts) \
+            or any(char in name for char in " ~^:?*[\\\t\n") or name == "HEAD":
+        raise Exception(f"'{name}' is not a valid branch name")
+    return name
+
+class PackedRefs:
+    """Sorted packed-refs file, read once and binary-searched by ref name."""
+    def __init__(self,path):
+        self.names = []
+        self.values = []
+        if not os.path.exists(path):
+            return
+        entries = []
+        with open(path,"r") as file:
+            for line in file:
+                if line.startswith("#") or not line.strip():
+                    continue
+                sha1,_,name = line.rstrip("\n").partition(" ")
+                entries.append((name,sha1))
+        entries.sort()
+        self.names = [name for name,_ in entries]
+        self.values = [sha1 for _,sha1 in entries]
+
+    def get(self,name):
+        position = bisect_left(self.names,name)
+        if position < len(self.names) and self.names[position] == name:
+            return self.values[position]
+        return None
+
+    def prefixed(self,prefix):
+        position = bisect_left(self.names,prefix)
+        while position < len(self.names) and self.names[position].startswith(prefix):
+            yield self.names[position],self.values[position]
+            position += 1
+
+loaded_packed_refs = None
+
+def packed_refs():
+    global loaded_packed_refs
+    if loaded_packed_refs is None:
+        loaded_packed_refs = PackedRefs(ref_path("packed-refs"))
+    return loaded_packed_refs
+
+def clear_cache():
+    global loaded_packed_refs
+    loaded_packed_refs = None
+
+def read_loose(ref):
+    try:
+        with open(ref_path(*ref.split("/")),"r") as file:
+            return file.read().strip() or None
+    except (FileNotFoundError,IsADirectoryError,NotADirectoryError):
+        return None
+
+def read_ref(ref):
+    return read_loose(ref) or packed_refs().get(ref)
+
+def read_branch(name):
+    return read_ref(HEADS_PREFIX+name)
+
+def loose_refs(prefix=HEADS_PREFIX):
+    top = ref_path(*prefix.rstrip("/").split("/"))
+    refs = {}
+    for root,_,files in os.walk(top):
+        for name in files:
+            if name.endswith(".lock"):
+                continue
+            ref = prefix+os.path.relpath(os.path.join(root,name),top).replace(os.sep,"/")
+            sha1 = read_loose(ref)
+            if sha1:
+                refs[ref] = sha1
+    return refs
+
+def branches():
+    """Sorted (name, sha1) pairs of every branch; loose refs override packed ones."""
+    refs = dict(packed_refs().prefixed(HEADS_PREFIX))
+    refs.update(loose_refs())
+    return [(ref[len(HEADS_PREFIX):],refs[ref]) for ref in sorted(refs)]
+
+def check_ref_available(ref):
+    """Refuse a ref that would need to be a file where another ref needs a directory, or the other way round."""
+    parts = ref.split("/")
+    for depth in range(1,len(parts)):
+        parent = "/".join(parts[:depth])
+        if read_ref(parent):
+            raise Exception(f"Cannot create '{ref[len(HEADS_PREFIX):]}': '{parent[len(HEADS_PREFIX):]}' already exists")
+    below = next(packed_refs().prefixed(ref+"/"),None) or next(iter(loose_refs(ref+"/").items()),None)
+    if below:
+        raise Exception(f"Cannot create '{ref[len(HEADS_PREFIX):]}': '{below[0][len(HEADS_PREFIX):]}' already exists")
+    path = ref_path(*parts)
+    if os.path.isdir(path):
+        # Only empty directories left behind by deleted or packed refs can remain here.
+        for root,_,_ in os.walk(path,topdown=False):
+            os.rmdir(root)
+
+def write_file(path,content):
+    os.makedirs(os.path.dirname(path),exist_ok=True)
+    lock_path = f"{path}.lock"
+    try:
+        fd = os.open(lock_path,os.O_WRONLY | os.O_CREAT | os.O_EXCL,0o666)
+    except FileExistsError:
+        raise Exception(f"Unable to create '{lock_path}': another microgit process may be running; remove the file if it is not")
+    try:
+        with os.fdopen(fd,"w") as file:
+            file.write(content)
+        os.replace(lock_path,path)
+    except BaseException:
+        if os.path.exists(lock_path):
+            os.remove(lock_path)
+        raise
+
+def write_ref(ref,sha1,message,identity=""):
+    try:
+        old = read_ref(ref)
+        if old is None:
+            check_ref_available(ref)
+        write_file(ref_path(*ref.split("/")),sha1)
+        append_reflog(ref,old,sha1,message,identity)
+    except Exception as ex:
+        raise ex
+
+def append_reflog(ref,old,new,message,identity=""):
+    try:
+        path = ref_path("logs",*ref.split("/"))
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        line = f"{old or '0'*40} {new or '0'*40} {identity} {int(time.time())} {time.strftime('%z')}\t{message}\n"
+        with open(path,"a") as file:
+            file.write(line)
+    except Exception as ex:
+        raise ex
+
+def read_reflog(ref):
+    path = ref_path("logs",*ref.split("/"))
+    if not os.path.exists(path):
+        return []
+    entries = []
+    with open(path,"r") as file:
+        for line in file:
+            header,_,message = line.rstrip("\n").partition("\t")
+            fields = header.split(" ")
+            entries.append((fields[0],fields[1]," ".join(fields[2:-2]),int(fields[-2]),fields[-1],message))
+    return entries
+
+def pack_refs():
+    """Move every loose branch into packed-refs; returns the number of refs packed."""
+    try:
+        loose = loose_refs()
+        refs = dict(packed_refs().prefixed(HEADS_PREFIX))
+        refs.update(loose)
+        write_file(ref_path("packed-refs"),PACKED_REFS_HEADER+"".join(f"{refs[ref]} {ref}\n" for ref in sorted(refs)))
+        clear_cache()
+        for ref,sha1 in loose.items():
+            # A ref updated while packing keeps its newer loose value.
+            if read_loose(ref) == sha1:
+                os.remove(ref_path(*ref.split("/")))
+        heads = ref_path("refs","heads")
+        for root,dirs,files in os.walk(heads,topdown=False):
+            if root != heads and not os.listdir(root):
+                os.rmdir(root)
+        return len(refs)
+    except Exception as ex:
+        raise ex
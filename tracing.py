@@ -0,0 +1,77 @@
+import os
+import json
+import time
+import _thread
+import functools
+
+enabled = False
+events = []
+counters = {}
+origin = time.perf_counter_ns()
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc_info):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class Span:
+    __slots__ = ("name","args","start")
+
+    def __init__(self,name,args):
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self,*exc_info):
+        end = time.perf_counter_ns()
+        event = {"name":self.name,"ph":"X","ts":(self.start-origin)/1000,"dur":(end-self.start)/1000,
+                 "pid":os.getpid(),"tid":_thread.get_ident()}
+        if self.args:
+            event["args"] = self.args
+        events.append(event)
+        return False
+
+def span(name,**args):
+    if not enabled:
+        return NULL_SPAN
+    return Span(name,args)
+
+def traced(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args,**kwargs):
+            if not enabled:
+                return function(*args,**kwargs)
+            with Span(name,{}):
+                return function(*args,**kwargs)
+        return wrapper
+    return decorator
+
+def count(name,value=1):
+    if enabled:
+        counters[name] = counters.get(name,0) + value
+
+def enable():
+    global enabled,origin
+    enabled = True
+    origin = time.perf_counter_ns()
+    events.clear()
+    counters.clear()
+
+def disable():
+    global enabled
+    enabled = False
+
+def write(path):
+    now = (time.perf_counter_ns()-origin)/1000
+    counter_events = [{"name":name,"ph":"C","ts":now,"pid":os.getpid(),"args":{name:value}} for name,value in sorted(counters.items())]
+    with open(path,"w") as file:
+        json.dump({"traceEvents":events+counter_events,"displayTimeUnit":"ms","otherData":{"counters":counters}},file)